@@ -11,6 +11,8 @@ from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 import subprocess
 import time
 
+from Main import fading_still_clip, feather_tachie
+
 
 class CharacterVideoMaker:
     def __init__(self,
@@ -132,23 +134,14 @@ class CharacterVideoMaker:
         formation = ImageEnhance.Color(formation).enhance(0.8)
         rm_image = Image.open("./resources/Cover.png")
         rm_image = rm_image.convert("RGBA")
-        Tachie = Image.open(char_image_path)
-        Tachie = Tachie.convert("RGBA")
+        Tachie = feather_tachie(Image.open(char_image_path))
 
         TachieMask = Image.open("./resources/Mask.png")
         TachieMask = TachieMask.convert("RGBA")
 
         TachieWidth, TachieHeight = Tachie.size
-        maskImg = Image.new("L", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(maskImg)
-        maskDraw.rectangle([(TachieWidth / 1.4), 0, TachieWidth, TachieHeight], fill=255)
-        maskImg = maskImg.filter(ImageFilter.GaussianBlur(80))
-
-        Empty = Image.new("RGBA", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(Empty)
-
         formation.alpha_composite(rm_image)
-        formation.alpha_composite(Image.composite(Empty, Tachie, maskImg),
+        formation.alpha_composite(Tachie,
                                   ((-round(TachieWidth / 2) + 520) + x, 90 - y))
 
         # 3. 计算文本区域
@@ -343,10 +336,8 @@ class CharacterVideoMaker:
         # 创建单帧图像
         frame_array = self.create_frame_with_text(title_text, voice_text, x, y)
 
-        # 创建视频片段（使用单帧图像）
-        video = ImageClip(frame_array, duration=duration)
-        video = video.with_effects([vfx.CrossFadeIn(1)]).copy()
-        video = video.with_effects([vfx.CrossFadeOut(1)]).copy()
+        # 创建视频片段（使用单帧图像），只有淡入淡出的帧需要计算
+        video = fading_still_clip(frame_array, duration, 1, 1)
 
         # 添加音频（音频结束后保持画面）
         video = video.with_audio(audio)
@@ -497,8 +488,7 @@ class CharacterVideoMaker:
         formation = ImageEnhance.Color(formation).enhance(0.8)
         rm_image = Image.open("./resources/Cover.png")
         rm_image = rm_image.convert("RGBA")
-        Tachie = Image.open(char_image_path)
-        Tachie = Tachie.convert("RGBA")
+        Tachie = feather_tachie(Image.open(char_image_path))
         TachieRuler = Image.open("./resources/TachieRuler.png")
         TachieRuler = TachieRuler.convert("RGBA")
 
@@ -506,14 +496,6 @@ class CharacterVideoMaker:
         TachieMask = TachieMask.convert("RGBA")
 
         TachieWidth, TachieHeight = Tachie.size
-        maskImg = Image.new("L", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(maskImg)
-        maskDraw.rectangle([(TachieWidth / 1.4), 0, TachieWidth, TachieHeight], fill=255)
-        maskImg = maskImg.filter(ImageFilter.GaussianBlur(80))
-
-        Empty = Image.new("RGBA", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(Empty)
-
         OriginalX, OriginalY = (-round(TachieWidth / 2) + 520), 90
         x, y = 0, 0
 
@@ -523,7 +505,7 @@ class CharacterVideoMaker:
             final_draw = ImageDraw.Draw(formation)
 
             formation.alpha_composite(rm_image)
-            formation.alpha_composite(Image.composite(Empty, Tachie, maskImg), (OriginalX + x, OriginalY - y))
+            formation.alpha_composite(Tachie, (OriginalX + x, OriginalY - y))
             final_draw.text((834, 45), Char_CN_Name, font=font_name, fill=text_color)
             width = final_draw.textlength(text=Char_CN_Name) + 835
             print(type(width))
@@ -1,16 +1,408 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
+import itertools
 import json
 import os
+import sqlite3
+from contextlib import closing
 from pathlib import Path
 
 from moviepy import *
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
 import subprocess
+import tempfile
 import time
 
+from text_wrap import wrap_paragraph
+from audio_probe import probe_duration
+from compositing import fade_frame
+from video_export import encode_still_timeline, encode_segments_parallel, write_audio_track
+
+
+# ========== 字体注册表 =========
+# 使用本地Fonts文件夹的字体，所有帧共用同一组字体对象
+FONT_DIR = "Fonts"
+
+# (字体族, 字重) -> 字体文件
+FONT_FILES = {
+    ("Noto Serif SC", "Bold"): os.path.join(FONT_DIR, "NotoSerifSC-Bold.ttf"),
+    ("Noto Sans SC", "Regular"): os.path.join(FONT_DIR, "NotoSansSC-Regular.ttf"),
+    ("Noto Sans SC", "Medium"): os.path.join(FONT_DIR, "NotoSansSC-Medium.ttf"),
+}
+
+# 本地字体未找到时使用的备用字体
+FALLBACK_FONT_PATHS = [
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+]
+
+_font_paths = {}  # (字体族, 字重) -> 解析后的字体文件（None表示PIL默认字体）
+_font_cache = {}  # (字体族, 字重, 字号) -> ImageFont
+
+
+def resolve_font_path(family, weight):
+    """解析字体文件路径，每个(字体族, 字重)只解析一次"""
+    key = (family, weight)
+    if key not in _font_paths:
+        font_path = FONT_FILES.get(key)
+        if not font_path or not os.path.exists(font_path):
+            print(f"警告：未找到字体 {family} {weight}，使用备用字体")
+            font_path = None
+            for fallback_path in FALLBACK_FONT_PATHS:
+                if os.path.exists(fallback_path):
+                    font_path = fallback_path
+                    break
+        _font_paths[key] = font_path
+
+    return _font_paths[key]
+
+
+def get_font(family, weight, size):
+    """获取共享字体对象，每个(字体族, 字重, 字号)只从磁盘加载一次"""
+    key = (family, weight, size)
+    if key not in _font_cache:
+        font_path = resolve_font_path(family, weight)
+        try:
+            if font_path:
+                _font_cache[key] = ImageFont.truetype(font_path, size)
+            else:
+                _font_cache[key] = ImageFont.load_default()
+        except Exception as e:
+            print(f"字体加载警告: {e}")
+            _font_cache[key] = ImageFont.load_default()
+
+    return _font_cache[key]
+
+
+# ========== 台词索引 =========
+# charword_table.json编译为本地SQLite索引，每次运行只读取当前角色的台词
+CHARWORD_INDEX_SUFFIX = ".index.sqlite"
+
+
+def _file_sha256(path):
+    """计算文件的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_index_meta(index_path):
+    """读取索引记录的源文件信息，索引不存在或损坏时返回None"""
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with closing(sqlite3.connect(index_path)) as conn:
+            return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.DatabaseError:
+        return None
+
+
+def build_charword_index(json_path, index_path, sha256=None):
+    """解析charword_table.json并写入SQLite索引（先写本进程的临时文件，完成后替换）"""
+    print("编译台词索引...")
+    stat = os.stat(json_path)
+    sha256 = sha256 or _file_sha256(json_path)
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        json_full = json.load(f)
+    words = json_full.get('charWords', json_full)
+
+    # 每个进程使用各自的临时文件，同时编译同一份索引时不会互相覆盖或删除
+    partial_path = f"{index_path}.{os.getpid()}.partial"
+    try:
+        with closing(sqlite3.connect(partial_path)) as conn:
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            # word_key为JSON中的键，rowid保持JSON中的顺序
+            conn.execute("CREATE TABLE words (word_key TEXT PRIMARY KEY, char_id TEXT, voice_id TEXT, data TEXT)")
+            conn.executemany(
+                "INSERT INTO words (word_key, char_id, voice_id, data) VALUES (?, ?, ?, ?)",
+                (
+                    (key, item.get('charId'), item.get('voiceId'), json.dumps(item, ensure_ascii=False))
+                    for key, item in words.items()
+                    if isinstance(item, dict)
+                ),
+            )
+            conn.execute("CREATE INDEX words_char_voice ON words (char_id, voice_id)")
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                ('mtime_ns', str(stat.st_mtime_ns)),
+                ('size', str(stat.st_size)),
+                ('sha256', sha256),
+            ])
+            conn.commit()
+
+        os.replace(partial_path, index_path)
+    finally:
+        # 编译失败时删除不完整的临时文件（成功时已被改名，不存在）
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def ensure_charword_index(json_path, index_path=None):
+    """
+    返回最新的台词索引路径
+
+    修改时间和大小都没变时直接使用；有变化时再比较文件哈希，
+    内容确实变了才重新编译
+    """
+    index_path = index_path or str(Path(json_path).with_suffix(CHARWORD_INDEX_SUFFIX))
+    stat = os.stat(json_path)
+    meta = _read_index_meta(index_path)
+
+    if meta is not None:
+        if (meta.get('mtime_ns') == str(stat.st_mtime_ns) and
+                meta.get('size') == str(stat.st_size)):
+            return index_path
+
+        sha256 = _file_sha256(json_path)
+        if meta.get('sha256') == sha256:
+            # 内容没变（例如文件被重新复制），只更新记录的修改时间
+            with closing(sqlite3.connect(index_path)) as conn:
+                conn.executemany("UPDATE meta SET value = ? WHERE key = ?", [
+                    (str(stat.st_mtime_ns), 'mtime_ns'),
+                    (str(stat.st_size), 'size'),
+                ])
+                conn.commit()
+            return index_path
+    else:
+        sha256 = None
+
+    build_charword_index(json_path, index_path, sha256)
+    return index_path
+
+
+def load_character_words(index_path, char_id):
+    """从索引中读取单个角色的台词，返回 JSON键 -> 台词数据（保持原顺序）"""
+    # 键以"角色ID_"开头的条目也一并读取，与按键名查找的规则一致
+    # （'_'的下一个字符是'`'，用范围查询代替LIKE以使用主键索引）
+    prefix = f"{char_id}_"
+    with closing(sqlite3.connect(index_path)) as conn:
+        rows = conn.execute(
+            "SELECT word_key, data FROM words "
+            "WHERE char_id = ? OR (word_key >= ? AND word_key < ?) ORDER BY rowid",
+            (char_id, prefix, f"{char_id}`"),
+        ).fetchall()
+    return {key: json.loads(data) for key, data in rows}
+
+
+def diff_charword_tables(old_json_path, new_json_path, char_id):
+    """按(charId, voiceId)比较新旧charword_table.json，返回该角色标题或台词有变化的voiceId列表"""
+    def character_lines(json_path):
+        with open(json_path, 'r', encoding='utf-8') as f:
+            json_full = json.load(f)
+        words = json_full.get('charWords', json_full)
+        lines = {}
+        for item in words.values():
+            if isinstance(item, dict) and item.get('charId') == char_id:
+                lines.setdefault(item.get('voiceId'), (item.get('voiceTitle'), item.get('voiceText')))
+        return lines
+
+    old_lines = character_lines(old_json_path)
+    new_lines = character_lines(new_json_path)
+    return sorted(voice_id for voice_id in old_lines.keys() | new_lines.keys()
+                  if old_lines.get(voice_id) != new_lines.get(voice_id))
+
+
+# ========== 音频时长探测 =========
+# 直接读取音频文件头获取时长，不需要启动ffmpeg解码
+
+# GPU编码时同时编码的片段数（消费级显卡同时能开的NVENC会话有限）
+NVENC_SEGMENT_JOBS = 2
+
+
+def probe_audio_durations(audio_files):
+    """批量读取音频时长，返回 路径 -> 时长（秒）；无法解析的文件不包含在结果中"""
+    durations = {}
+    for audio_file in audio_files:
+        try:
+            durations[str(audio_file)] = probe_duration(audio_file)
+        except ValueError as e:
+            print(f"  警告: {e}")
+    return durations
+
+
+# ========== 淡入淡出 =========
+# 静态画面的淡入淡出：只有淡入淡出期间的帧用uint8查找表调暗，完全不透明的帧直接返回原画面
+
+
+def fading_still_clip(frame, duration, fade_in, fade_out):
+    """
+    静态画面片段，开头从黑色淡入、结尾淡出到黑色
+
+    替代逐帧计算的FadeIn/FadeOut效果：中间的帧直接返回同一张画面，不做任何计算，
+    淡入淡出期间的帧查表得到，不经过浮点运算
+    """
+    frame = np.ascontiguousarray(frame[:, :, :3])
+
+    def frame_function(t):
+        if t < fade_in:
+            alpha = t / fade_in
+        elif t > duration - fade_out:
+            alpha = (duration - t) / fade_out
+        else:
+            return frame
+        return fade_frame(frame, alpha)
+
+    return VideoClip(frame_function, duration=duration)
+
+
+# ========== 立绘遮罩 =========
+# 立绘右侧的羽化：原来在整张立绘大小的"L"图上画矩形再GaussianBlur(80)，
+# 但矩形占满整个高度，模糊结果每一行都相同，只需要算一行的横向曲线再按行广播
+
+FEATHER_RADIUS = 80  # 羽化半径（与原来的GaussianBlur(80)相同）
+FEATHER_START = 1 / 1.4  # 从立绘宽度的这个比例处开始淡出
+
+_feather_profiles = {}  # 立绘宽度 -> 每列保留的比例(0-255, uint16)
+
+
+def feather_profile(width):
+    """
+    宽度为width的立绘每一列保留的比例（255为完全保留），按宽度缓存
+
+    只对一行像素做模糊，结果与整张图模糊后的任意一行完全相同
+    """
+    profile = _feather_profiles.get(width)
+    if profile is None:
+        row = Image.new("L", (width, 1))
+        ImageDraw.Draw(row).rectangle([width * FEATHER_START, 0, width, 1], fill=255)
+        mask = np.asarray(row.filter(ImageFilter.GaussianBlur(FEATHER_RADIUS)))[0]
+        profile = (255 - mask).astype(np.uint16)
+        _feather_profiles[width] = profile
+    return profile
+
+
+def feather_tachie(tachie):
+    """
+    返回右侧羽化后的RGBA立绘
+
+    直接把每列的保留比例乘到四个通道上，不再创建透明的Empty图做composite，
+    取整方式与Image.composite相同，结果逐像素一致
+    """
+    pixels = np.asarray(tachie.convert("RGBA"))
+    keep = feather_profile(pixels.shape[1])[None, :, None]
+    # 像素*比例/255，与PIL的混合一样四舍五入
+    value = pixels * keep
+    value += 128
+    value += value >> 8
+    value >>= 8
+    return Image.fromarray(value.astype(np.uint8))
+
+
+# ========== 立绘定位 =========
+# 不再逐次输入偏移量预览：按立绘透明通道的统计量直接算出对准TachieRuler.png的偏移量，
+# 结果保存在立绘旁的.placement.json中，之后运行直接读取（手动修改该文件即可微调）
+
+TACHIE_CENTER_X = 520  # 偏移量为0时立绘中心的x坐标（与_get_base_layer相同）
+TACHIE_TOP_Y = 90  # 偏移量为0时立绘顶边的y坐标
+TACHIE_HEAD_ABOVE_RULER = 300  # 人物顶部对齐标尺中心上方的最高刻度
+TACHIE_TOP_QUANTILE = 0.005  # 透明度累计到该比例的行作为人物顶部，忽略零散的发梢和花瓣
+
+
+def find_ruler_center(ruler_path):
+    """标尺十字线的中心：不透明像素最多的列和行（线有几像素宽时取中间）"""
+    alpha = np.asarray(Image.open(ruler_path).convert("RGBA"))[:, :, 3] >= 128
+    columns = alpha.sum(axis=0)
+    rows = alpha.sum(axis=1)
+    return np.flatnonzero(columns == columns.max()).mean(), np.flatnonzero(rows == rows.max()).mean()
+
+
+def tachie_anchor(tachie):
+    """
+    立绘中人物的横向重心和顶部（立绘内的像素坐标）
+
+    Returns:
+        (重心x, 顶部y)，立绘完全透明时返回(宽度/2, 0)
+    """
+    alpha = np.asarray(tachie.convert("RGBA"))[:, :, 3].astype(np.float32)
+    columns = alpha.sum(axis=0)
+    total = columns.sum()
+    if total == 0:
+        return alpha.shape[1] / 2, 0
+
+    center_x = (columns * np.arange(alpha.shape[1])).sum() / total
+    top = int(np.searchsorted(np.cumsum(alpha.sum(axis=1)), total * TACHIE_TOP_QUANTILE))
+    return center_x, top
+
+
+def auto_tachie_offset(tachie_path, ruler_path):
+    """
+    计算立绘对准标尺的偏移量(x, y)，含义与Tachie_Check的输入相同（y向上为正）
+
+    人物重心对准标尺的竖线，人物顶部对准标尺中心上方TACHIE_HEAD_ABOVE_RULER处
+    """
+    tachie = Image.open(tachie_path)
+    ruler_x, ruler_y = find_ruler_center(ruler_path)
+    center_x, top = tachie_anchor(tachie)
+
+    placed_x = center_x - round(tachie.width / 2) + TACHIE_CENTER_X
+    placed_top = top + TACHIE_TOP_Y
+    return round(ruler_x - placed_x), round(placed_top - (ruler_y - TACHIE_HEAD_ABOVE_RULER))
+
+
+def tachie_placement_path(tachie_path):
+    """立绘偏移量的旁注文件路径（与立绘同名，后缀.placement.json）"""
+    return Path(tachie_path).with_suffix(".placement.json")
+
+
+def load_tachie_placement(tachie_path):
+    """读取保存的立绘偏移量，没有或损坏时返回None"""
+    try:
+        with open(tachie_placement_path(tachie_path), 'r', encoding='utf-8') as f:
+            placement = json.load(f)
+        return int(placement['x']), int(placement['y'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_tachie_placement(tachie_path, x, y, method):
+    """保存立绘偏移量，method记录来源（auto或manual）"""
+    with open(tachie_placement_path(tachie_path), 'w', encoding='utf-8') as f:
+        json.dump({'x': x, 'y': y, 'method': method}, f, ensure_ascii=False, indent=2)
+
+
+# ========== 共享底图 =========
+# 与角色无关的底图（模糊背景+遮罩）按输入文件指纹保存为.npy，
+# 同时运行的多个进程以只读内存映射方式打开同一个文件，共用系统页缓存，不再各自解码和模糊
+
+# 底图的合成方式改变时加1，使旧缓存失效
+LAYER_CACHE_VERSION = 1
+
+
+def load_shared_layer(name, sources, build, cache_dir):
+    """
+    读取共享的只读底图（numpy内存映射，不复制数据），缓存中没有时调用build生成并写入
+
+    Args:
+        name: 底图名称（用于缓存文件名）
+        sources: 底图依赖的输入文件，任何一个的大小或修改时间变化都会重新生成
+        build: 生成底图的函数，返回numpy数组
+        cache_dir: 缓存目录，None时直接返回build的结果
+    """
+    if not cache_dir:
+        return build()
+
+    fingerprints = []
+    for source in sources:
+        stat = os.stat(source)
+        fingerprints.append([os.path.abspath(source), stat.st_size, stat.st_mtime_ns])
+    payload = json.dumps([LAYER_CACHE_VERSION, name, fingerprints])
+    key = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    layer_path = os.path.join(cache_dir, f"{name}_{key}.npy")
+
+    if not os.path.exists(layer_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # 先写临时文件再改名，其他进程不会读到写了一半的文件
+        partial_path = f"{layer_path[:-4]}.{os.getpid()}.partial.npy"
+        np.save(partial_path, build())
+        os.replace(partial_path, layer_path)
+
+    return np.load(layer_path, mmap_mode='r')
+
 
 class CharacterVideoMaker:
     def __init__(self,
@@ -20,7 +412,12 @@ class CharacterVideoMaker:
                  background_path,
                  cv_name="配音演员姓名",
                  audio_interval=3,
-                 output_resolution=(1920, 1080)):
+                 output_resolution=(1920, 1080),
+                 still_export=True,
+                 segment_jobs=None,
+                 use_charword_index=True,
+                 segment_cache_dir=None,
+                 layer_cache_dir=None):
         """
         初始化视频制作器
 
@@ -32,6 +429,11 @@ class CharacterVideoMaker:
             cv_name: 配音演员姓名
             audio_interval: 音频间隔时间（秒）
             output_resolution: 输出分辨率
+            still_export: 静态帧快速导出（每张画面只交给ffmpeg一次，跳过MoviePy逐帧渲染）
+            segment_jobs: 快速导出时并行编码的片段数（默认CPU核心数，1为单次编码）
+            use_charword_index: 使用编译好的SQLite台词索引，只读取当前角色的台词
+            segment_cache_dir: 已编码片段的缓存目录（按内容哈希复用，崩溃或改文本后重跑只需拼接），None为不缓存
+            layer_cache_dir: 共享底图的缓存目录（同时运行的多个进程内存映射同一份底图），None为不缓存
         """
         self.char_image_path = char_image_path
         self.audio_folder = audio_folder
@@ -40,34 +442,45 @@ class CharacterVideoMaker:
         self.cv_name = cv_name
         self.audio_interval = audio_interval
         self.width, self.height = output_resolution
+        self.still_export = still_export
+        self.segment_jobs = segment_jobs or os.cpu_count() or 1
+        self.segment_cache_dir = segment_cache_dir
+        self.layer_cache_dir = layer_cache_dir
 
         # 从人物图片名提取ID
         self.char_name = Path(char_image_path).stem
         self.char_id = self.char_name
 
-        # 加载JSON数据
-        with open(json_path, 'r', encoding='utf-8') as f:
-            json_full = json.load(f)
-            self.json_data = json_full.get('charWords', json_full)
-
-        # 预处理背景图（只处理一次）
-        self.processed_bg = self._preprocess_background()
+        # 加载台词数据（优先使用索引，只读取当前角色）
+        self.json_data = None
+        if use_charword_index:
+            try:
+                index_path = ensure_charword_index(json_path)
+                self.json_data = load_character_words(index_path, self.char_id)
+            except (sqlite3.Error, OSError) as e:
+                print(f"台词索引不可用，改为读取完整JSON: {e}")
+
+        if self.json_data is None:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                json_full = json.load(f)
+                self.json_data = json_full.get('charWords', json_full)
+
+        # (角色ID, 语音ID) -> 台词数据，同一语音有多条时以第一条为准
+        self._voice_lookup = {}
+        if isinstance(self.json_data, dict):
+            for item in self.json_data.values():
+                if isinstance(item, dict):
+                    self._voice_lookup.setdefault((item.get('charId'), item.get('voiceId')), item)
 
         # 预处理人物图片（只处理一次）
         self.processed_char = self._preprocess_character()
 
-    def _preprocess_background(self):
-        """预处理背景图：调整大小并添加模糊效果"""
-        print("预处理背景图...")
-        bg = Image.open(self.background_path).convert('RGBA')
-
-        # 调整到目标分辨率
-        bg = bg.resize((self.width, self.height), Image.Resampling.LANCZOS)
-
-        # 应用高斯模糊
-        bg = bg.filter(ImageFilter.GaussianBlur(radius=10))
+        # 预加载字体（每种字体只从磁盘加载一次）
+        self._get_fonts()
 
-        return np.array(bg)
+        # 静态底图缓存（背景+遮罩+立绘），按立绘偏移量(x, y)索引
+        self._backdrop = None
+        self._base_layers = {}
 
     def _preprocess_character(self):
         """预处理人物图片：调整大小"""
@@ -84,14 +497,49 @@ class CharacterVideoMaker:
 
         return char_img, (target_width, target_height)
 
+    def _build_backdrop(self):
+        """背景（缩放、模糊、调暗）叠加遮罩，与角色无关"""
+        formation = Image.open(self.background_path)
+        formation = formation.convert("RGBA")
+        formation = formation.resize(size=(1920, 1080))
+        formation = formation.filter(ImageFilter.GaussianBlur(10))
+        formation = ImageEnhance.Brightness(formation).enhance(0.5)
+        formation = ImageEnhance.Color(formation).enhance(0.8)
+        rm_image = Image.open("Cover.png")
+        rm_image = rm_image.convert("RGBA")
+        formation.alpha_composite(rm_image)
+        return np.array(formation)
+
+    def _get_backdrop(self):
+        """获取共享的只读底图（背景+遮罩），只处理一次"""
+        if self._backdrop is None:
+            self._backdrop = load_shared_layer('backdrop', [self.background_path, "Cover.png"],
+                                               self._build_backdrop, self.layer_cache_dir)
+        return self._backdrop
+
+    def _get_base_layer(self, x, y):
+        """
+        获取静态底图（背景+遮罩+立绘）
+        底图与语音文本无关，同一立绘偏移量下所有语音共用一张
+        """
+        key = (x, y)
+        if key not in self._base_layers:
+            print("预合成静态底图...")
+            # 共享底图是只读的，复制一份再叠加立绘
+            formation = Image.fromarray(np.array(self._get_backdrop()))
+            Tachie = feather_tachie(Image.open(self.char_image_path))
+
+            TachieWidth = Tachie.width
+            formation.alpha_composite(Tachie, ((-round(TachieWidth / 2) + 520) + x, 90 - y))
+            self._base_layers[key] = formation
+
+        return self._base_layers[key]
+
     def create_frame_with_text(self, title, voice_text, x, y):
         """
         创建单帧完整图像（背景+人物+所有文字）
         这是性能优化的关键：一次性渲染所有元素
         """
-        # 复制背景（已经是模糊的）
-        frame = Image.fromarray(self.processed_bg.copy())
-
         # 获取字体
         font_cv, font_title, font_text, font_name, font_ENname = self._get_fonts()
 
@@ -124,31 +572,8 @@ class CharacterVideoMaker:
         overlay_draw.rounded_rectangle(cv_bg_rect, radius=5, fill=bg_color)
         '''
 
-        formation = Image.open(background_path)
-        formation = formation.convert("RGBA")
-        formation = formation.resize(size=(1920, 1080))
-        formation = formation.filter(ImageFilter.GaussianBlur(10))
-        formation = ImageEnhance.Brightness(formation).enhance(0.5)
-        formation = ImageEnhance.Color(formation).enhance(0.8)
-        rm_image = Image.open("Cover.png")
-        rm_image = rm_image.convert("RGBA")
-        Tachie = Image.open(char_image_path)
-        Tachie = Tachie.convert("RGBA")
-
-        TachieMask = Image.open("Mask.png")
-        TachieMask = TachieMask.convert("RGBA")
-
-        TachieWidth, TachieHeight = Tachie.size
-        maskImg = Image.new("L", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(maskImg)
-        maskDraw.rectangle([(TachieWidth / 1.4), 0, TachieWidth, TachieHeight], fill=255)
-        maskImg = maskImg.filter(ImageFilter.GaussianBlur(80))
-
-        Empty = Image.new("RGBA", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(Empty)
-
-        formation.alpha_composite(rm_image)
-        formation.alpha_composite(Image.composite(Empty, Tachie, maskImg), ((-round(TachieWidth / 2) + 520) + x, 90 - y))
+        # 复制预合成的静态底图，每条语音只需绘制文字
+        formation = self._get_base_layer(x, y).copy()
 
         # 3. 计算文本区域
         content_width = 800
@@ -210,128 +635,35 @@ class CharacterVideoMaker:
         return np.array(formation)
 
     def _get_fonts(self):
-        """获取字体对象"""
-        try:
-            # 使用本地Fonts文件夹的MiSans字体
-            font_dir = "Fonts"
-
-            # 尝试加载MiSans字体
-            font_cv = font_title = font_text = None
-
-            font_name = [
-                os.path.join(font_dir, "NotoSerifSC-Bold.ttf")
-            ]
-            for font_path in font_name:
-                if os.path.exists(font_path):
-                    font_name = ImageFont.truetype(font_path, size=160)
-
-            font_ENname = [
-                os.path.join(font_dir, "NotoSansSC-Regular.ttf")
-            ]
-            for font_path in font_ENname:
-                if os.path.exists(font_path):
-                    font_ENname = ImageFont.truetype(font_path, size=72)
-
-            # CV字体使用Semibold
-            cv_font_paths = [
-                os.path.join(font_dir, "NotoSansSC-Regular.ttf"),
-            ]
-            for font_path in cv_font_paths:
-                if os.path.exists(font_path):
-                    font_cv = ImageFont.truetype(font_path, 36)
-                    break
-
-            # 标题使用Bold或Demibold（粗体）
-            title_font_paths = [
-                os.path.join(font_dir, "NotoSansSC-Medium.ttf")
-            ]
-            for font_path in title_font_paths:
-                if os.path.exists(font_path):
-                    font_title = ImageFont.truetype(font_path, 60)
-                    break
-
-            # 正文使用Regular或Semibold（较细）
-            text_font_paths = [
-                os.path.join(font_dir, "NotoSansSC-Regular.ttf")
-            ]
-            for font_path in text_font_paths:
-                if os.path.exists(font_path):
-                    font_text = ImageFont.truetype(font_path, 36)  # 字体大小调整为50
-                    break
-
-            # 如果MiSans字体未找到，使用备用字体
-            if not font_cv or not font_title or not font_text:
-                print("警告：未找到完整的字体，使用备用字体")
-                fallback_paths = [
-                    "C:/Windows/Fonts/msyh.ttc",
-                    "C:/Windows/Fonts/simhei.ttf",
-                ]
-                for font_path in fallback_paths:
-                    if os.path.exists(font_path):
-                        if not font_cv:
-                            font_cv = ImageFont.truetype(font_path, 36)
-                        if not font_title:
-                            font_title = ImageFont.truetype(font_path, 60)
-                        if not font_text:
-                            font_text = ImageFont.truetype(font_path, 50)
-                        if not font_name:
-                            font_name = ImageFont.truetype(font_path, 160)
-                        if not font_ENname:
-                            font_ENname = ImageFont.truetype(font_path, 72)
-                        break
-
-            # 最后的后备方案
-            if not font_cv:
-                font_cv = ImageFont.load_default()
-            if not font_title:
-                font_title = ImageFont.load_default()
-            if not font_text:
-                font_text = ImageFont.load_default()
-            if not font_name:
-                font_name = ImageFont.load_default()
-
-        except Exception as e:
-            print(f"字体加载警告: {e}")
-            default = ImageFont.load_default()
-            font_cv = font_title = font_text = default
+        """获取字体对象（从字体注册表取共享实例）"""
+        font_cv = get_font("Noto Sans SC", "Regular", 36)
+        font_title = get_font("Noto Sans SC", "Medium", 60)
+        font_text = get_font("Noto Sans SC", "Regular", 36)
+        font_name = get_font("Noto Serif SC", "Bold", 160)
+        font_ENname = get_font("Noto Sans SC", "Regular", 72)
 
         return font_cv, font_title, font_text, font_name, font_ENname
 
     def _wrap_text(self, text, font, max_width, draw):
         """文本自动换行"""
         lines = []
-        current_line = ""
-
-        for char in text:
-            if char == '\n':
-                if current_line:
-                    lines.append(current_line)
-                    current_line = ""
-            else:
-                test_line = current_line + char
-                # 测试文本宽度
-                bbox = draw.textbbox((0, 0), test_line, font=font)
-                line_width = bbox[2] - bbox[0]
-
-                if line_width <= max_width:
-                    current_line = test_line
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = char
 
-        if current_line:
-            lines.append(current_line)
+        for paragraph in text.split('\n'):
+            if paragraph:
+                lines.extend(wrap_paragraph(paragraph, font, max_width, draw))
 
         return lines
 
-    def process_single_audio(self, audio_file, voice_data, x, y):
+    def process_single_audio(self, audio_file, voice_data, x, y, audio_duration=None):
         """
         处理单个音频文件（优化版）
+        返回不带音频的画面片段，音频在导出前预先混成整条音轨
         """
-        # 加载音频
-        audio = AudioFileClip(audio_file)
-        duration = audio.duration + self.audio_interval  # 包含间隔时间
+        if audio_duration is None:
+            audio = AudioFileClip(audio_file)
+            audio_duration = audio.duration
+            audio.close()
+        duration = audio_duration + self.audio_interval  # 包含间隔时间
 
         # 获取文本信息
         title_text = voice_data.get('voiceTitle', '未知标题')
@@ -341,24 +673,38 @@ class CharacterVideoMaker:
         # 创建单帧图像
         frame_array = self.create_frame_with_text(title_text, voice_text, x, y)
 
-        # 创建视频片段（使用单帧图像）
-        video = ImageClip(frame_array, duration=duration)
-        VideoName = title_text + ".mp4"
-        video.write_videofile(filename=VideoName, fps= 24 , temp_audiofile_path="./Temp", threads=4)
+        # 创建视频片段（使用单帧图像），只有淡入淡出的帧需要计算
+        # 片段只在最终导出时编码一次，不再单独导出每条语音
+        video = fading_still_clip(frame_array, duration, 1, 1)
 
-        EffectedVideo = VideoFileClip(VideoName)
-        EffectedVideo.with_effects([vfx.CrossFadeIn(1), vfx.CrossFadeOut(1)]).copy()
+        return video
 
-        '''
-        VideoName = VideoFileClip("./Temp/"+VideoName)
-        VideoName.preview()
-        '''
+    def build_still_segment(self, audio_file, voice_data, x, y, audio_duration=None):
+        """
+        处理单个音频文件（静态帧快速导出）
+        只生成画面、时长和音频路径，交给ffmpeg直接编码
 
+        audio_duration: 预先从文件头读取的音频时长，None时打开音频获取
+        """
+        if audio_duration is None:
+            audio = AudioFileClip(audio_file)
+            audio_duration = audio.duration
+            audio.close()
+        duration = audio_duration + self.audio_interval  # 包含间隔时间
+
+        title_text = voice_data.get('voiceTitle', '未知标题')
+        voice_text = voice_data.get('voiceText', '')
+        print(title_text, voice_text)
 
-        # 添加音频（音频结束后保持画面）
-        EffectedVideo = video.with_audio(audio)
+        frame_array = self.create_frame_with_text(title_text, voice_text, x, y)
 
-        return EffectedVideo
+        return {
+            'image': frame_array,
+            'duration': duration,
+            'audio': audio_file,
+            'fade_in': 1,
+            'fade_out': 1,
+        }
 
     def find_voice_data(self, voice_id):
         """根据voiceId查找语音数据"""
@@ -376,15 +722,36 @@ class CharacterVideoMaker:
                 if key in self.json_data:
                     return self.json_data[key]
 
-            # 遍历所有值查找匹配
-            for key, item in self.json_data.items():
-                if isinstance(item, dict):
-                    if (item.get('charId') == self.char_id and
-                            item.get('voiceId') == full_voice_id):
-                        return item
+            # 按(角色ID, 语音ID)查找
+            return self._voice_lookup.get((self.char_id, full_voice_id))
 
         return None
 
+    def resolve_voice_lines(self, audio_files):
+        """为每个音频文件查找语音数据，返回[(音频文件, 语音数据或None)]，预计时长和生成片段共用同一份结果"""
+        voice_lines = []
+        for audio_file in audio_files:
+            # 提取音频ID
+            audio_name = audio_file.stem
+            voice_id = audio_name.split('_')[1] if '_' in audio_name else audio_name
+
+            # 查找对应的语音数据
+            voice_lines.append((audio_file, self.find_voice_data(voice_id)))
+        return voice_lines
+
+    def iter_voice_lines(self, voice_lines):
+        """按顺序逐条生成有文本数据的语音：(音频文件, 语音数据)，没有文本数据的跳过"""
+        total_files = len(voice_lines)
+        for idx, (audio_file, voice_data) in enumerate(voice_lines, 1):
+            audio_name = audio_file.stem
+            if not voice_data:
+                print(f"[{idx}/{total_files}] 跳过 {audio_name} (未找到文本数据)")
+                continue
+
+            print(f"[{idx}/{total_files}] 处理: {audio_name}")
+            print(f"  标题: {voice_data.get('voiceTitle', '未知')}")
+            yield audio_file, voice_data
+
     def create_video(self, x, y):
         """创建完整视频（优化版）"""
         # 获取所有音频文件
@@ -396,29 +763,48 @@ class CharacterVideoMaker:
             print("未找到音频文件")
             return
 
-        video_clips = []
-        total_files = len(audio_files)
+        print(f"\n找到 {len(audio_files)} 个音频文件")
 
-        print(f"\n找到 {total_files} 个音频文件")
-        print("-" * 40)
+        # 语音数据只查找一次；没有文本数据的语音不会生成片段，也不计入预计时长
+        voice_lines = self.resolve_voice_lines(audio_files)
+        line_files = [audio_file for audio_file, voice_data in voice_lines if voice_data]
 
-        for idx, audio_file in enumerate(audio_files, 1):
-            # 提取音频ID
-            audio_name = audio_file.stem
-            voice_id = audio_name.split('_')[1] if '_' in audio_name else audio_name
+        # 只读取文件头获取音频时长，解码前就能确定时间线
+        durations = probe_audio_durations(line_files)
+        if durations:
+            planned = sum(durations.values()) + self.audio_interval * len(line_files)
+            unknown = len(line_files) - len(durations)
+            # 文件头无法解析的音频导出时才能得到时长，未计入预计时长
+            note = f"（{unknown} 个音频文件的时长未知，未计入）" if unknown else ""
+            print(f"预计视频时长: {planned:.1f} 秒{note}")
+        print("-" * 40)
 
-            # 查找对应的语音数据
-            voice_data = self.find_voice_data(voice_id)
+        # 输出文件名
+        output_filename = f"{self.char_name}.mp4"
 
-            if not voice_data:
-                print(f"[{idx}/{total_files}] 跳过 {audio_name} (未找到文本数据)")
-                continue
+        if self.still_export:
+            # 静态片段按需逐个生成，导出时每个片段写出画面后即释放，内存占用与语音数量无关
+            segments = (self.build_still_segment(str(audio_file), voice_data, x, y,
+                                                 durations.get(str(audio_file)))
+                        for audio_file, voice_data in self.iter_voice_lines(voice_lines))
+            first_segment = next(segments, None)
+            if first_segment is None:
+                print("没有可用的视频片段")
+                return
 
-            print(f"[{idx}/{total_files}] 处理: {audio_name}")
-            print(f"  标题: {voice_data.get('voiceTitle', '未知')}")
+            # 静态片段直接交给ffmpeg按时间线拼接
+            print(f"导出视频: {output_filename}")
+            print("-" * 40)
+            self.export_video_optimized(itertools.chain([first_segment], segments), output_filename)
+            return
 
-            # 处理单个音频
-            clip = self.process_single_audio(str(audio_file), voice_data, x, y)
+        # MoviePy导出需要同时持有所有片段
+        video_clips = []
+        audio_segments = []  # 用于预混音轨的语音和片段时长
+        for audio_file, voice_data in self.iter_voice_lines(voice_lines):
+            clip = self.process_single_audio(str(audio_file), voice_data, x, y,
+                                             durations.get(str(audio_file)))
+            audio_segments.append({'audio': str(audio_file), 'duration': clip.duration})
             video_clips.append(clip)
 
         # 合并所有视频片段
@@ -426,24 +812,59 @@ class CharacterVideoMaker:
             print("\n合并视频片段...")
             final_video = concatenate_videoclips(video_clips)
 
-            # 输出文件名
-            output_filename = f"{self.char_name}.mp4"
-
-            # 导出视频
-            print(f"导出视频: {output_filename}")
-            print("-" * 40)
-            self.export_video_optimized(final_video, output_filename)
+            with tempfile.TemporaryDirectory(prefix="audio_track_") as temp_dir:
+                # 所有语音预先混成一条音轨，导出时只有一个音频读取进程
+                print("预混音轨...")
+                audio_path = write_audio_track(
+                    audio_segments, [segment['duration'] for segment in audio_segments],
+                    os.path.join(temp_dir, "audio.wav"))
+                audio_track = AudioFileClip(audio_path)
+                try:
+                    # 导出视频
+                    print(f"导出视频: {output_filename}")
+                    print("-" * 40)
+                    self.export_video_optimized(final_video.with_audio(audio_track), output_filename)
+                finally:
+                    # 删除临时目录前先关闭音轨
+                    audio_track.close()
         else:
             print("没有可用的视频片段")
 
     def export_video_optimized(self, final_video, output_filename):
-        """优化的视频导出方法"""
+        """
+        优化的视频导出方法
+
+        Args:
+            final_video: MoviePy视频片段，或静态片段的可迭代对象（走ffmpeg快速导出，片段可以逐个生成）
+            output_filename: 输出文件名
+        """
         start_time = time.time()
 
         # 检查是否有GPU支持
         gpu_available = self.check_gpu_support()
 
-        if gpu_available:
+        if not hasattr(final_video, 'write_videofile'):
+            if gpu_available and self.segment_cache_dir:
+                # 片段缓存只在分片段导出时生效；NVENC同时编码的路数有限，只并行少量片段
+                jobs = min(self.segment_jobs, NVENC_SEGMENT_JOBS)
+                print(f"使用 GPU 加速分片段导出（{jobs} 路片段并行编码，使用片段缓存）...")
+                encode_segments_parallel(final_video, output_filename, fps=24,
+                                         codec='h264_nvenc', preset='fast', bitrate="8000k",
+                                         jobs=jobs, cache_dir=self.segment_cache_dir)
+            elif gpu_available:
+                print("使用 GPU 加速导出（静态帧快速导出）...")
+                encode_still_timeline(final_video, output_filename, fps=24,
+                                      codec='h264_nvenc', preset='fast', bitrate="8000k")
+            elif self.segment_jobs > 1 or self.segment_cache_dir:
+                print(f"使用 CPU 分片段导出（{self.segment_jobs} 路片段并行编码）...")
+                encode_segments_parallel(final_video, output_filename, fps=24,
+                                         codec='libx264', preset='faster', bitrate="6000k",
+                                         jobs=self.segment_jobs, cache_dir=self.segment_cache_dir)
+            else:
+                print("使用 CPU 导出（静态帧快速导出）...")
+                encode_still_timeline(final_video, output_filename, fps=24,
+                                      codec='libx264', preset='faster', bitrate="6000k", threads=8)
+        elif gpu_available:
             print("使用 GPU 加速导出...")
             # GPU加速导出
             final_video.write_videofile(
@@ -481,6 +902,10 @@ class CharacterVideoMaker:
         print(f"  文件: {output_filename}")
         print(f"  大小: {file_size:.2f} MB")
 
+    def uses_segment_cache(self):
+        """导出时是否会使用片段缓存（只有静态帧快速导出会按片段编码和复用）"""
+        return self.still_export and bool(self.segment_cache_dir)
+
     def check_gpu_support(self):
         """检查GPU编码支持"""
         try:
@@ -501,8 +926,7 @@ class CharacterVideoMaker:
         formation = formation.filter(ImageFilter.GaussianBlur(10)); formation = ImageEnhance.Brightness(formation).enhance(0.5); formation = ImageEnhance.Color(formation).enhance(0.8)
         rm_image = Image.open("Cover.png")
         rm_image = rm_image.convert("RGBA")
-        Tachie = Image.open(char_image_path)
-        Tachie = Tachie.convert("RGBA")
+        Tachie = feather_tachie(Image.open(char_image_path))
         TachieRuler = Image.open("TachieRuler.png")
         TachieRuler = TachieRuler.convert("RGBA")
 
@@ -510,20 +934,13 @@ class CharacterVideoMaker:
         TachieMask = TachieMask.convert("RGBA")
 
         TachieWidth, TachieHeight = Tachie.size
-        maskImg = Image.new("L", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(maskImg)
-        maskDraw.rectangle([(TachieWidth / 1.4), 0, TachieWidth, TachieHeight], fill=255)
-        maskImg = maskImg.filter(ImageFilter.GaussianBlur(80))
-
-        Empty = Image.new("RGBA", (TachieWidth, TachieHeight))
-        maskDraw = ImageDraw.Draw(Empty)
 
         OriginalX, OriginalY = (-round(TachieWidth / 2) + 520), 90
         x, y = 0, 0
 
         while True:
             formation.alpha_composite(rm_image)
-            formation.alpha_composite(Image.composite(Empty, Tachie, maskImg), (OriginalX + x, OriginalY - y))
+            formation.alpha_composite(Tachie, (OriginalX + x, OriginalY - y))
             formation.alpha_composite(TachieRuler)
             formation.show()
 
@@ -542,6 +959,35 @@ class CharacterVideoMaker:
 
         return(x, y)
 
+    def place_tachie(self, ruler_path="TachieRuler.png", interactive=False):
+        """
+        获取立绘偏移量：有保存的结果时直接使用，否则自动计算（或交互式调整）并保存
+
+        Args:
+            ruler_path: 标尺图片路径
+            interactive: 使用原来的交互式Tachie_Check，而不是自动计算
+
+        Returns:
+            (x, y) 立绘偏移量
+        """
+        placement_path = tachie_placement_path(self.char_image_path)
+        saved = load_tachie_placement(self.char_image_path)
+        if saved is not None:
+            print(f"使用已保存的立绘位置: x={saved[0]}, y={saved[1]} ({placement_path})")
+            return saved
+
+        if interactive:
+            x, y = self.Tachie_Check()
+            method = "manual"
+        else:
+            x, y = auto_tachie_offset(self.char_image_path, ruler_path)
+            method = "auto"
+            print(f"自动计算立绘位置: x={x}, y={y}")
+
+        save_tachie_placement(self.char_image_path, x, y, method)
+        print(f"立绘位置已保存: {placement_path}")
+        return x, y
+
 # ========== 配置参数 =========
 # 请根据实际情况修改以下路径和参数
 Char_CN_Name = "遙"
@@ -552,6 +998,10 @@ json_path = "charword_table.json"  # JSON文件路径
 background_path = "background.png"  # 背景图路径
 cv_name = "丰田萌绘"  # 配音演员姓名
 audio_interval = 3  # 音频间隔（秒）
+segment_cache_dir = "segment_cache"  # 已编码片段的缓存目录，None为不缓存
+layer_cache_dir = "layer_cache"  # 共享底图的缓存目录（同时制作多个角色时共用同一份底图），None为不缓存
+old_json_path = None  # 旧版charword_table.json，设置后只重新编码台词有变化的片段（需要片段缓存）
+tachie_placement = "auto"  # 立绘定位："auto"按标尺自动计算，"manual"交互式预览调整；结果保存在立绘旁的.placement.json，之后直接使用
 
 def main():
     """主函数"""
@@ -582,6 +1032,17 @@ def main():
         print("\n请检查文件路径后重试")
         return
 
+    # 补丁模式：台词没有变化就不需要重新生成
+    changed = []
+    if old_json_path:
+        char_id = Path(char_image_path).stem
+        changed = diff_charword_tables(old_json_path, json_path, char_id)
+        if changed:
+            print(f"\n{len(changed)} 条台词有变化: {', '.join(changed)}")
+        elif os.path.exists(f"{char_id}.mp4"):
+            print("\n台词没有变化，无需重新生成")
+            return
+
     print("\n开始制作视频...")
     print("-" * 40)
 
@@ -593,10 +1054,15 @@ def main():
             json_path=json_path,
             background_path=background_path,
             cv_name=cv_name,
-            audio_interval=audio_interval
+            audio_interval=audio_interval,
+            segment_cache_dir=segment_cache_dir,
+            layer_cache_dir=layer_cache_dir
         )
 
-        x, y = maker.Tachie_Check()
+        if changed and not maker.uses_segment_cache():
+            print("未使用片段缓存，将完整重新生成")
+
+        x, y = maker.place_tachie(interactive=(tachie_placement == "manual"))
 
         # 开始制作
         maker.create_video(x, y)
@@ -1,9 +1,11 @@
 
-from PIL import Image, ImageDraw, ImageFilter
+from PIL import Image
 from moviepy import VideoFileClip
 
 from moviepy import *
 
+from Main import feather_tachie
+
 clip = VideoFileClip("./test.mp4")
 clip = clip.fx(vfx.fadein, 1)
 clip = clip.fx(vfx.fadeout, 1)
@@ -12,21 +14,12 @@ formation = Image.open("BG.png")
 formation = formation.convert("RGBA")
 rm_image = Image.open("Cover.png")
 rm_image = rm_image.convert("RGBA")
-Tachie = Image.open("Haruka.png")
-Tachie = Tachie.convert("RGBA")
+Tachie = feather_tachie(Image.open("Haruka.png"))
 
 TachieMask = Image.open("Mask.png")
 TachieMask = TachieMask.convert("RGBA")
 
 TachieWidth, TachieHeight = Tachie.size
-maskImg = Image.new("L", (TachieWidth, TachieHeight))
-maskDraw = ImageDraw.Draw(maskImg)
-maskDraw.rectangle([(TachieWidth/1.4), 0, TachieWidth, TachieHeight], fill=255)
-maskImg = maskImg.filter(ImageFilter.GaussianBlur(80))
-
-Empty = Image.new("RGBA", (TachieWidth, TachieHeight))
-maskDraw = ImageDraw.Draw(Empty)
-
 formation.alpha_composite(rm_image)
-formation.alpha_composite(Image.composite(Empty, Tachie, maskImg),((-round(TachieWidth/2)+520),90))
+formation.alpha_composite(Tachie,((-round(TachieWidth/2)+520),90))
 formation.show()
\ No newline at end of file
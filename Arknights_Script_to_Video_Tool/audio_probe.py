@@ -0,0 +1,288 @@
+import os
+import struct
+from pathlib import Path
+
+# MPEG音频帧头查找表
+# 比特率(kbps)：(MPEG版本是否为1, 层) -> 按索引排列
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# 采样率：版本位 -> 按索引排列（3: MPEG1, 2: MPEG2, 0: MPEG2.5）
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+
+# 只读取文件开头这么多字节用于查找帧头和VBR标签
+_MP3_SCAN_BYTES = 64 * 1024
+
+# MP3解码器固有的延迟采样数（不含编码器延迟）
+MP3_DECODER_DELAY = 529
+
+
+def probe_wav_duration(path):
+    """从RIFF头读取WAV时长（秒），不解码音频数据"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff not in (b'RIFF', b'RF64') or wave != b'WAVE':
+            raise ValueError(f"不是WAV文件: {path}")
+
+        block_align = None
+        sample_rate = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"WAV文件缺少data块: {path}")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                _, _, sample_rate, _, block_align = struct.unpack('<HHIIH', fmt[:14])
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if not block_align or not sample_rate:
+                    raise ValueError(f"WAV文件缺少fmt块: {path}")
+                # 流式写出的文件data大小可能是占位值，以实际文件大小为准
+                data_size = min(chunk_size, file_size - f.tell())
+                return (data_size // block_align) / sample_rate
+            else:
+                # 块按偶数字节对齐
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _skip_id3v2(data):
+    """返回ID3v2标签之后的位置（没有标签时为0）"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _parse_mp3_header(data, pos):
+    """解析pos处的MPEG音频帧头，无效时返回None"""
+    if pos + 4 > len(data):
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    mono = (b3 >> 6) == 3
+
+    if layer == 1:
+        samples_per_frame = 384
+        frame_size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if (layer == 2 or mpeg1) else 576
+        frame_size = (samples_per_frame // 8) * bitrate // sample_rate + padding
+
+    return {
+        'mpeg1': mpeg1,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'mono': mono,
+        'samples_per_frame': samples_per_frame,
+        'frame_size': frame_size,
+    }
+
+
+def _find_first_frame(data, start):
+    """从start开始查找第一个有效帧头（要求下一帧帧头也有效，避免误判），返回(位置, 帧头)"""
+    pos = data.find(b'\xFF', start)
+    while pos != -1:
+        header = _parse_mp3_header(data, pos)
+        if header is not None:
+            next_pos = pos + header['frame_size']
+            if next_pos + 4 > len(data) or _parse_mp3_header(data, next_pos) is not None:
+                return pos, header
+        pos = data.find(b'\xFF', pos + 1)
+    return None, None
+
+
+def _read_vbr_frames(data, pos, header):
+    """读取第一帧中的Xing/Info或VBRI标签，返回(总帧数, 编码器延迟采样数, 末尾补齐采样数)，没有标签时返回None"""
+    # Xing/Info标签位于side info之后
+    if header['mpeg1']:
+        side_info = 17 if header['mono'] else 32
+    else:
+        side_info = 9 if header['mono'] else 17
+    xing = pos + 4 + side_info
+
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if not flags & 0x01:
+            return None
+        frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+
+        # LAME扩展标签记录了编码器延迟和末尾补齐的采样数
+        # （位于Xing标签各可选字段之后：帧数、字节数、TOC、质量）
+        lame = xing + 8
+        lame += 4 if flags & 0x01 else 0
+        lame += 4 if flags & 0x02 else 0
+        lame += 100 if flags & 0x04 else 0
+        lame += 4 if flags & 0x08 else 0
+        delay = 0
+        padding = 0
+        if data[lame:lame + 4] in (b'LAME', b'Lavc', b'Lavf') and len(data) >= lame + 24:
+            b0, b1, b2 = data[lame + 21:lame + 24]
+            delay = (b0 << 4) | (b1 >> 4)
+            padding = ((b1 & 0x0F) << 8) | b2
+        return frames, delay, padding
+
+    # VBRI标签固定位于帧头后32字节
+    vbri = pos + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        frames = struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+        return frames, 0, 0
+
+    return None
+
+
+def probe_mp3_duration(path):
+    """从MPEG帧头和Xing/Info/VBRI标签读取MP3时长（秒），不解码音频数据"""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        # 跳过开头的ID3v2标签（可能带封面图，很大）
+        start = _skip_id3v2(f.read(10))
+        f.seek(start)
+        data = f.read(_MP3_SCAN_BYTES)
+        f.seek(max(0, file_size - 128))
+        has_id3v1 = f.read(3) == b'TAG'
+
+    pos, header = _find_first_frame(data, 0)
+    if header is None:
+        raise ValueError(f"找不到MP3帧头: {path}")
+
+    vbr = _read_vbr_frames(data, pos, header)
+    if vbr is not None:
+        frames, delay, padding = vbr
+        samples = frames * header['samples_per_frame'] - delay - padding
+        return max(0, samples) / header['sample_rate']
+
+    # 没有VBR标签，按固定比特率估算
+    audio_size = file_size - start - pos - (128 if has_id3v1 else 0)
+    return audio_size * 8 / header['bitrate']
+
+
+def read_mp3_frames(path):
+    """
+    读取MP3文件中的全部音频帧（去掉ID3标签和Xing/Info/VBRI标签帧），用于不重新编码的拼接
+
+    Returns:
+        dict:
+            header: 第一帧的帧头信息
+            header_bytes: 第一帧的4字节帧头
+            data: 音频帧数据
+            frames: 帧数
+            delay: 解码输出中语音内容之前的采样数（编码器延迟+解码器延迟）
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    start = _skip_id3v2(data[:10])
+    pos, header = _find_first_frame(data, start)
+    if header is None:
+        raise ValueError(f"找不到MP3帧头: {path}")
+    header_bytes = data[pos:pos + 4]
+
+    # 标签帧不含音频，跳过
+    delay = MP3_DECODER_DELAY
+    vbr = _read_vbr_frames(data, pos, header)
+    if vbr is not None:
+        delay += vbr[1]
+        pos += header['frame_size']
+
+    first = pos
+    frames = 0
+    while True:
+        frame = _parse_mp3_header(data, pos)
+        # 遇到ID3v1/APE标签或文件结尾时结束
+        if frame is None or pos + frame['frame_size'] > len(data):
+            break
+        if (frame['sample_rate'] != header['sample_rate'] or frame['mono'] != header['mono']
+                or frame['layer'] != header['layer']):
+            raise ValueError(f"MP3文件中途改变了音频格式: {path}")
+        pos += frame['frame_size']
+        frames += 1
+
+    return {
+        'header': header,
+        'header_bytes': header_bytes,
+        'data': data[first:pos],
+        'frames': frames,
+        'delay': delay,
+    }
+
+
+def make_silent_mp3_frame(header_bytes):
+    """
+    按给定帧头的格式生成一帧静音MP3（第三层）
+
+    使用最低比特率、无CRC、全零的side info（所有频谱值为0），
+    解码结果是精确的数字静音，可以直接插入同格式的MP3帧序列中
+    """
+    b0, b1, b2, b3 = header_bytes
+    # 不带CRC；比特率索引1，保留采样率，不补位
+    header = bytes([b0, b1 | 0x01, (1 << 4) | (b2 & 0x0C), b3])
+    frame = _parse_mp3_header(header, 0)
+    if frame is None or frame['layer'] != 3:
+        raise ValueError("只能为MP3（第三层）生成静音帧")
+    return header + bytes(frame['frame_size'] - 4)
+
+
+# 扩展名 -> 时长探测函数
+PROBES = {
+    '.wav': probe_wav_duration,
+    '.mp3': probe_mp3_duration,
+}
+
+
+def probe_duration(path):
+    """只读取文件头获取音频时长（秒），不支持的格式或无法解析时抛出ValueError"""
+    probe = PROBES.get(Path(path).suffix.lower())
+    if probe is None:
+        raise ValueError(f"不支持的音频格式: {path}")
+    try:
+        return probe(path)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"无法解析音频头: {path} ({e})")
+
+
+def probe_folder(folder, pattern='*'):
+    """
+    批量探测文件夹中音频文件的时长
+
+    Returns:
+        路径 -> 时长（秒）；无法解析的文件不包含在结果中
+    """
+    durations = {}
+    for path in sorted(Path(folder).glob(pattern)):
+        if path.suffix.lower() not in PROBES:
+            continue
+        try:
+            durations[path] = probe_duration(path)
+        except ValueError as e:
+            print(f"  警告: {e}")
+    return durations
@@ -0,0 +1,87 @@
+# 字形度量缓存：字体对象 -> {字符: (步进宽度, 墨迹左边界, 墨迹右边界)}
+_glyph_metrics = {}
+
+# 字距调整缓存：字体对象 -> {(前一字符, 当前字符): 调整量}
+_kerning = {}
+
+
+def _get_glyph_metrics(font, char):
+    """获取单个字形的度量，每个字体的每个字符只测量一次"""
+    metrics = _glyph_metrics.setdefault(font, {})
+    if char not in metrics:
+        left, _, right, _ = font.getbbox(char)
+        metrics[char] = (font.getlength(char), left, right)
+    return metrics[char]
+
+
+def _get_kerning(font, prev_char, char):
+    """获取两个字符之间的字距调整量（字体没有字距表时为0）"""
+    pairs = _kerning.setdefault(font, {})
+    key = (prev_char, char)
+    if key not in pairs:
+        pairs[key] = (font.getlength(prev_char + char)
+                      - font.getlength(prev_char) - font.getlength(char))
+    return pairs[key]
+
+
+def _predict_line_end(paragraph, start, font, max_width):
+    """用缓存的字形度量估算从start开始一行能放下的字符结束位置"""
+    pen = 0
+    ink_left = None
+    ink_right = None
+    prev_char = None
+
+    for i in range(start, len(paragraph)):
+        char = paragraph[i]
+        advance, left, right = _get_glyph_metrics(font, char)
+        if prev_char is not None:
+            pen += _get_kerning(font, prev_char, char)
+
+        if ink_left is None:
+            ink_left = left
+            ink_right = right
+        else:
+            ink_right = max(ink_right, pen + right)
+
+        # 每行至少保留一个字符
+        if ink_right - ink_left > max_width and i > start:
+            return i
+
+        pen += advance
+        prev_char = char
+
+    return len(paragraph)
+
+
+def wrap_paragraph(paragraph, font, max_width, draw):
+    """
+    将一段不含换行符的文本按最大宽度折行
+
+    先用缓存的字形步进宽度和字距线性估算断行位置，再用textbbox校验断点，
+    结果与逐字调用textbbox测量整行前缀完全一致
+    """
+    def line_width(start, end):
+        bbox = draw.textbbox((0, 0), paragraph[start:end], font=font)
+        return bbox[2] - bbox[0]
+
+    lines = []
+    start = 0
+    length = len(paragraph)
+
+    while start < length:
+        end = _predict_line_end(paragraph, start, font, max_width)
+
+        if line_width(start, end) <= max_width:
+            # 估算偏保守，继续向后尝试
+            while end < length and line_width(start, end + 1) <= max_width:
+                end += 1
+        else:
+            # 估算偏宽，向前回退到能放下的位置（至少一个字符）
+            end = max(end - 1, start + 1)
+            while end > start + 1 and line_width(start, end) > max_width:
+                end -= 1
+
+        lines.append(paragraph[start:end])
+        start = end
+
+    return lines
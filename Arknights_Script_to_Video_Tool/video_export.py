@@ -0,0 +1,474 @@
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pathlib import Path
+from PIL import Image
+
+from audio_probe import make_silent_mp3_frame, read_mp3_frames
+
+try:
+    from moviepy.config import FFMPEG_BINARY
+except ImportError:
+    from moviepy.config import get_setting
+    FFMPEG_BINARY = get_setting("FFMPEG_BINARY")
+
+# 音频参数（与MoviePy导出时一致）
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+# 片段缓存格式版本，片段的编码方式改变时加1，使旧缓存失效
+SEGMENT_CACHE_VERSION = 1
+
+
+def _memo_get(memo, image):
+    """
+    按画面对象查找已记录的结果
+
+    片段是逐个生成、用完即释放的，释放后的id可能被新画面复用，
+    所以同时保存弱引用，只有仍是同一个对象时才算命中
+    """
+    entry = memo.get(id(image))
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    return None
+
+
+def _memo_set(memo, image, value):
+    """记录画面对象对应的结果（只保存弱引用，不延长画面的生命周期）"""
+    memo[id(image)] = (weakref.ref(image), value)
+
+
+def _write_still(image, temp_dir, index, written):
+    """把第index个片段的画面写入临时目录（同一个画面对象只写入一次），返回图片文件名"""
+    name = _memo_get(written, image)
+    if name is None:
+        name = f"still_{index:04d}.png"
+        Image.fromarray(image[:, :, :3]).save(os.path.join(temp_dir, name), compress_level=1)
+        _memo_set(written, image, name)
+    return name
+
+
+def _segment_info(segment):
+    """片段中除画面以外的信息（时长、语音、淡入淡出），画面写出后只保留这些"""
+    return {key: value for key, value in segment.items() if key != 'image'}
+
+
+def _write_concat_list(still_names, segments, list_path):
+    """生成ffmpeg concat demuxer的时间线描述文件"""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for name, segment in zip(still_names, segments):
+            f.write(f"file '{name}'\n")
+            f.write(f"duration {segment['duration']:.6f}\n")
+        # concat demuxer会忽略最后一项的时长，需要重复最后一帧
+        f.write(f"file '{still_names[-1]}'\n")
+
+
+def _decode_pcm(audio_path):
+    """用ffmpeg把语音文件解码为统一采样率的16位立体声PCM（每个文件只解码一次）"""
+    cmd = [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-i', str(audio_path),
+           '-f', 's16le', '-acodec', 'pcm_s16le',
+           '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS), '-']
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"音频解码失败: {audio_path}: {stderr[-2000:]}")
+    return np.frombuffer(result.stdout, dtype=np.int16).reshape(-1, AUDIO_CHANNELS)
+
+
+def write_audio_track(segments, durations, output_path):
+    """
+    把所有片段的语音预先混成一条连续的WAV音轨
+
+    音轨写入内存映射文件，每条语音解码后直接放到它在时间线上的采样位置，
+    片段剩余部分和没有语音的片段保持静音；超出片段时长的语音会被截断
+
+    Args:
+        segments: 片段列表（使用其中的audio路径）
+        durations: 每个片段在时间线上的时长（秒）
+        output_path: 输出WAV路径
+    """
+    # 按累计结束时间取整到采样点，误差不累积
+    boundaries = [0]
+    end_time = 0.0
+    for duration in durations:
+        end_time += duration
+        boundaries.append(round(end_time * AUDIO_SAMPLE_RATE))
+    total_samples = boundaries[-1]
+
+    block_align = AUDIO_CHANNELS * 2
+    data_size = total_samples * block_align
+    with open(output_path, 'wb') as f:
+        f.write(struct.pack('<4sI4s4sIHHIIHH4sI',
+                            b'RIFF', 36 + data_size, b'WAVE',
+                            b'fmt ', 16, 1, AUDIO_CHANNELS, AUDIO_SAMPLE_RATE,
+                            AUDIO_SAMPLE_RATE * block_align, block_align, 16,
+                            b'data', data_size))
+        # 预先分配文件大小，未写入的部分即为静音
+        f.truncate(44 + data_size)
+
+    if total_samples == 0:
+        return output_path
+
+    track = np.memmap(output_path, dtype=np.int16, mode='r+', offset=44,
+                      shape=(total_samples, AUDIO_CHANNELS))
+    try:
+        for i, segment in enumerate(segments):
+            audio_path = segment.get('audio')
+            if not audio_path:
+                continue
+            start, end = boundaries[i], boundaries[i + 1]
+            pcm = _decode_pcm(audio_path)[:end - start]
+            track[start:start + len(pcm)] = pcm
+        track.flush()
+    finally:
+        del track
+
+    return output_path
+
+
+def write_mp3_track(segments, durations, output_path):
+    """
+    不重新编码，直接把各片段的MP3音频帧拼接成一条MP3音轨
+
+    语音之间用数字静音帧补齐到片段时长；每条语音开头的编解码器延迟也计算在内，
+    语音内容的起点与时间线的误差不超过半帧。
+    时间线开头的语音没有位置容纳延迟，整条音轨因此后移，
+    使用时需要把音轨提前返回的偏移量（ffmpeg的-itsoffset取负值）
+
+    Returns:
+        (输出路径, 音轨应提前的秒数)；有非MP3语音或各语音格式（采样率、声道、层）不一致时返回None
+    """
+    sources = {}
+    for segment in segments:
+        audio_path = segment.get('audio')
+        if not audio_path or audio_path in sources:
+            continue
+        if Path(audio_path).suffix.lower() != '.mp3':
+            return None
+        try:
+            sources[audio_path] = read_mp3_frames(audio_path)
+        except ValueError as e:
+            print(f"  警告: {e}")
+            return None
+
+    if not sources:
+        return None
+
+    formats = {(source['header']['sample_rate'], source['header']['mono'], source['header']['layer'])
+               for source in sources.values()}
+    if len(formats) != 1:
+        return None
+    sample_rate, _, layer = formats.pop()
+    if layer != 3:
+        return None
+
+    first = next(iter(sources.values()))
+    samples_per_frame = first['header']['samples_per_frame']
+    silent_frame = make_silent_mp3_frame(first['header_bytes'])
+
+    # 按累计结束时间取整到采样点，误差不累积
+    boundaries = [0]
+    end_time = 0.0
+    for duration in durations:
+        end_time += duration
+        boundaries.append(round(end_time * sample_rate))
+
+    # 音轨整体后移的采样数：保证每条语音扣除延迟后的写入位置都不早于音轨开头
+    shift = max([sources[segment['audio']]['delay'] - boundaries[i]
+                 for i, segment in enumerate(segments) if segment.get('audio')] + [0])
+
+    written = 0  # 已写入的采样数
+    with open(output_path, 'wb') as f:
+        for i, segment in enumerate(segments):
+            audio_path = segment.get('audio')
+            if not audio_path:
+                continue
+            source = sources[audio_path]
+
+            # 用静音帧补到语音应开始的位置（扣除编解码器延迟）
+            silent_frames = max(0, round((boundaries[i] + shift - source['delay'] - written) / samples_per_frame))
+            f.write(silent_frame * silent_frames)
+            written += silent_frames * samples_per_frame
+
+            f.write(source['data'])
+            written += source['frames'] * samples_per_frame
+
+        # 最后一条语音之后补静音到总时长
+        silent_frames = max(0, round((boundaries[-1] + shift - written) / samples_per_frame))
+        f.write(silent_frame * silent_frames)
+
+    return output_path, shift / sample_rate
+
+
+def _prepare_audio_track(segments, durations, temp_dir, audio_codec):
+    """
+    生成导出用的整条音轨，返回ffmpeg的音频输入参数和音频编码器
+
+    audio_codec为'copy'时尝试直接拼接MP3帧（不重新编码），
+    无法直接拼接时改为预混PCM音轨并编码为AAC
+    """
+    if audio_codec == 'copy':
+        mp3_track = write_mp3_track(segments, durations, os.path.join(temp_dir, "audio.mp3"))
+        if mp3_track is not None:
+            audio_path, offset = mp3_track
+            # 音轨为容纳开头语音的编解码器延迟整体后移了，输入时提前相同的时间
+            input_args = ['-itsoffset', f"{-offset:.6f}"] if offset else []
+            return input_args + ['-i', audio_path], 'copy'
+        print("  提示: 语音不是统一格式的MP3，无法直接复制，改为AAC编码")
+        audio_codec = 'aac'
+
+    audio_path = write_audio_track(segments, durations, os.path.join(temp_dir, "audio.wav"))
+    return ['-i', audio_path], audio_codec
+
+def _build_filter_script(segments, fps):
+    """生成视频滤镜脚本（帧率+淡入淡出）"""
+    video_filters = [f"fps={fps}"]
+    start = 0.0
+
+    for segment in segments:
+        duration = segment['duration']
+        fade_in = segment.get('fade_in', 0)
+        fade_out = segment.get('fade_out', 0)
+
+        # 淡入淡出只在对应的时间范围内启用，其余帧直接通过
+        if fade_in > 0:
+            end = start + fade_in
+            video_filters.append(f"fade=t=in:st={start:.6f}:d={fade_in}:enable='gte(t,{start:.6f})*lt(t,{end:.6f})'")
+        if fade_out > 0:
+            fade_start = start + duration - fade_out
+            end = start + duration
+            video_filters.append(f"fade=t=out:st={fade_start:.6f}:d={fade_out}:enable='gte(t,{fade_start:.6f})*lt(t,{end:.6f})'")
+        start += duration
+
+    video_filters.append("format=yuv420p")
+    return "[0:v]" + ",".join(video_filters) + "[vout]"
+
+
+def _video_codec_args(codec, preset, bitrate, threads):
+    """视频编码参数（所有导出方式共用，保证并行片段的编码参数完全一致）"""
+    args = ['-c:v', codec]
+    if preset:
+        args += ['-preset', preset]
+    if bitrate:
+        args += ['-b:v', bitrate]
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+
+def _run_ffmpeg(cmd):
+    """运行ffmpeg，失败时带上错误输出抛出异常"""
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg导出失败: {result.stderr.strip()[-2000:]}")
+
+
+def encode_still_timeline(segments, output_path, fps, codec='libx264', preset='medium',
+                          bitrate=None, audio_codec='aac', threads=None):
+    """
+    静态帧快速导出：每张静态帧只交给ffmpeg一次，由ffmpeg负责按时长重复画面
+
+    片段逐个读取，画面写入临时目录后即不再持有，内存占用与片段数量无关
+
+    Args:
+        segments: 片段的可迭代对象（可以是生成器），每项为dict：
+            image: 画面（numpy数组，RGB或RGBA）
+            duration: 片段时长（秒）
+            audio: 语音文件路径，没有则为None（静音）
+            fade_in / fade_out: 可选，淡入淡出时长（秒）
+        output_path: 输出视频路径
+        fps, codec, preset, bitrate, audio_codec, threads: 编码参数
+            （audio_codec为'copy'时直接复制MP3音频帧，不重新编码）
+
+    Returns:
+        导出的片段数
+    """
+    with tempfile.TemporaryDirectory(prefix="still_export_") as temp_dir:
+        written = {}
+        still_names = []
+        infos = []
+        for index, segment in enumerate(segments):
+            still_names.append(_write_still(segment['image'], temp_dir, index, written))
+            infos.append(_segment_info(segment))
+        if not infos:
+            raise ValueError("没有可导出的片段")
+
+        total_duration = sum(info['duration'] for info in infos)
+
+        list_path = os.path.join(temp_dir, "timeline.ffconcat")
+        _write_concat_list(still_names, infos, list_path)
+
+        # 所有语音预先混成一条音轨，ffmpeg只需要一个音频输入
+        audio_input, audio_codec = _prepare_audio_track(
+            infos, [info['duration'] for info in infos], temp_dir, audio_codec)
+
+        filter_path = os.path.join(temp_dir, "filters.txt")
+        with open(filter_path, 'w', encoding='utf-8') as f:
+            f.write(_build_filter_script(infos, fps))
+
+        cmd = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path, *audio_input,
+               '-filter_complex_script', filter_path,
+               '-map', '[vout]', '-map', '1:a']
+        cmd += _video_codec_args(codec, preset, bitrate, threads)
+        cmd += ['-c:a', audio_codec, '-t', f"{total_duration:.6f}", str(output_path)]
+
+        _run_ffmpeg(cmd)
+
+    return len(infos)
+
+
+def _encode_segment_video(still_path, frames, fps, fade_in, fade_out, codec_args, output_path):
+    """把一张静态帧编码为固定帧数的视频片段（不含音频）"""
+    # 图片只解码一次，由loop滤镜在内存中重复出固定帧数
+    video_filters = [f"loop=loop={frames - 1}:size=1:start=0", f"setpts=N/{fps}/TB"]
+    if fade_in > 0:
+        video_filters.append(f"fade=t=in:st=0:d={fade_in}")
+    if fade_out > 0:
+        video_filters.append(f"fade=t=out:st={frames / fps - fade_out:.6f}:d={fade_out}")
+    video_filters.append("format=yuv420p")
+
+    cmd = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error',
+           '-framerate', str(fps), '-i', still_path,
+           '-vf', ",".join(video_filters), '-r', str(fps), '-frames:v', str(frames)]
+    cmd += codec_args
+    cmd += ['-an', output_path]
+    _run_ffmpeg(cmd)
+
+
+def _image_digest(image):
+    """画面像素内容的哈希（画面已包含底图、立绘位置、文字和字体的全部结果）"""
+    digest = hashlib.sha256()
+    digest.update(repr(image.shape).encode())
+    digest.update(np.ascontiguousarray(image[:, :, :3]).tobytes())
+    return digest.hexdigest()
+
+
+def _segment_cache_key(image_digest, frames, fps, fade_in, fade_out, codec_args):
+    """片段缓存的键：画面内容、帧数和所有影响编码结果的参数"""
+    payload = json.dumps([SEGMENT_CACHE_VERSION, image_digest, frames, fps, fade_in, fade_out, codec_args])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def encode_segments_parallel(segments, output_path, fps, codec='libx264', preset='medium',
+                             bitrate=None, audio_codec='aac', jobs=None, threads=None, cache_dir=None):
+    """
+    并行片段导出：每个片段在线程池中各自用ffmpeg编码（编码参数完全一致），
+    再用concat demuxer直接复制视频流拼接，不做二次编码；音频预先混成整条音轨后只编码一次
+
+    片段逐个读取：每读到一个片段就写出画面并提交编码，之后不再持有画面，
+    后面的片段还在生成时前面的片段已经在编码，内存占用与片段数量无关
+
+    画面、帧数和淡入淡出都相同的片段只编码一次，在拼接列表中重复引用
+
+    片段时长按帧取整，音轨按取整后的时长排布，保证音画逐帧对齐
+
+    Args:
+        segments: 片段的可迭代对象（可以是生成器），格式同encode_still_timeline
+        jobs: 同时编码的片段数，默认为CPU核心数
+        threads: 每个片段编码使用的线程数，默认按核心数平均分配
+        cache_dir: 片段缓存目录。编码好的片段按内容哈希保存在这里，
+            重新运行时（例如崩溃后或只改了一句文本）直接复用，只重新拼接
+
+    Returns:
+        导出的片段数
+    """
+    cpu_count = os.cpu_count() or 1
+    jobs = jobs or cpu_count
+    threads = threads or max(1, cpu_count // jobs)
+    codec_args = _video_codec_args(codec, preset, bitrate, threads)
+    # 线程数不影响画面内容，不计入缓存键
+    key_args = _video_codec_args(codec, preset, bitrate, None)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def encode(still_path, frames, fade_in, fade_out, segment_path):
+        # 先写入临时文件再改名，中途崩溃不会在缓存中留下不完整的片段
+        partial_path = f"{segment_path[:-4]}.{os.getpid()}.partial.mp4"
+        _encode_segment_video(still_path, frames, fps, fade_in, fade_out, codec_args, partial_path)
+        os.replace(partial_path, segment_path)
+
+    with tempfile.TemporaryDirectory(prefix="segment_export_") as temp_dir, \
+            ThreadPoolExecutor(max_workers=jobs) as executor:
+        infos = []
+        frame_counts = []
+        segment_paths = []
+        pending = {}  # 需要编码的片段路径 -> 编码任务（内容相同的片段只编码一次）
+        reused = 0  # 运行前缓存中已有的片段数
+        duplicates = 0  # 与本次已提交编码的片段内容相同的片段数
+        written = {}
+        digests = {}
+
+        # 按累计结束时间取整到帧，避免每段的取整误差累积
+        start_frame = 0
+        end_time = 0.0
+        for index, segment in enumerate(segments):
+            end_time += segment['duration']
+            end_frame = max(start_frame + 1, round(end_time * fps))
+            frames = end_frame - start_frame
+            start_frame = end_frame
+
+            image = segment['image']
+            fade_in = segment.get('fade_in', 0)
+            fade_out = segment.get('fade_out', 0)
+            # 片段按内容命名：内容相同的片段（例如每条语音之后的间隔）只编码一次，拼接时重复引用
+            digest = _memo_get(digests, image)
+            if digest is None:
+                digest = _image_digest(image)
+                _memo_set(digests, image, digest)
+            key = _segment_cache_key(digest, frames, fps, fade_in, fade_out, key_args)
+            segment_path = os.path.join(cache_dir if cache_dir is not None else temp_dir, f"{key}.mp4")
+
+            # 只编码缓存中还没有的片段，画面写出后立即提交编码
+            if segment_path in pending:
+                duplicates += 1
+            elif os.path.exists(segment_path):
+                reused += 1
+            else:
+                still_path = os.path.join(temp_dir, _write_still(image, temp_dir, index, written))
+                pending[segment_path] = executor.submit(encode, still_path, frames, fade_in, fade_out,
+                                                        segment_path)
+
+            infos.append(_segment_info(segment))
+            frame_counts.append(frames)
+            segment_paths.append(segment_path)
+
+        if not infos:
+            raise ValueError("没有可导出的片段")
+        if cache_dir is not None:
+            print(f"  片段缓存: 复用 {reused}/{len(infos)} 个片段，编码 {len(pending)} 个，"
+                  f"与本次编码的片段相同 {duplicates} 个")
+        else:
+            print(f"  相同片段只编码一次: 编码 {len(pending)}/{len(infos)} 个片段，重复 {duplicates} 个")
+
+        for future in pending.values():
+            future.result()
+
+        list_path = os.path.join(temp_dir, "segments.ffconcat")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write("ffconcat version 1.0\n")
+            for segment_path in segment_paths:
+                # 缓存片段使用绝对路径；路径中的单引号需要转义
+                concat_path = Path(segment_path).resolve().as_posix().replace("'", "'\\''")
+                f.write(f"file '{concat_path}'\n")
+
+        # 视频流直接复制，音频预先混成整条音轨后编码一次（或直接复制MP3帧）
+        durations = [frames / fps for frames in frame_counts]
+        audio_input, audio_codec = _prepare_audio_track(infos, durations, temp_dir, audio_codec)
+
+        # 音轨按整帧补齐，可能比画面略长，按画面总时长截断
+        cmd = [FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', list_path, *audio_input,
+               '-map', '0:v', '-map', '1:a',
+               '-c:v', 'copy', '-c:a', audio_codec, '-t', f"{sum(durations):.6f}", str(output_path)]
+
+        _run_ffmpeg(cmd)
+
+    return len(infos)
@@ -1,3 +1,4 @@
+import itertools
 import json
 import os
 from pathlib import Path
@@ -10,6 +11,11 @@ except ImportError:
 import numpy as np
 from PIL import Image
 
+from voice_index import build_voice_index, get_voice_text, report_voice_coverage
+from audio_probe import probe_folder
+from compositing import fade_frame
+from video_export import encode_still_timeline
+
 # 增加PIL图片大小限制
 Image.MAX_IMAGE_PIXELS = None
 
@@ -19,6 +25,10 @@ VIDEO_HEIGHT = 1080
 FPS = 30
 FADE_DURATION = 0.5  # 淡入淡出时长
 INTERVAL_DURATION = 1.0  # 文本之间的间隔
+USE_STILL_ENCODER = True  # 每条语音的画面只合成一次，交给ffmpeg按时长重复，跳过MoviePy逐帧合成
+
+# 依次尝试的文本字体
+TEXT_FONTS = ['SimHei', 'Microsoft-YaHei', 'Microsoft-YaHei-UI', 'SimSun', 'Arial-Unicode-MS']
 
 # 路径设置
 BASE_DIR = Path(__file__).parent
@@ -31,43 +41,46 @@ def load_character_data():
         data = json.load(f)
     return data
 
-def get_voice_text(character_data, voice_id):
-    """根据语音ID获取对应的标题和描述"""
-    # 尝试从profileVoice获取
-    profile_voices = character_data.get('profileVoice', [])
-    for voice in profile_voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    # 如果profileVoice找不到，尝试voices
-    voices = character_data.get('voices', [])
-    for voice in voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    return "", ""
-
 def apply_fade(clip, fade_in_duration, fade_out_duration):
-    """应用淡入淡出效果"""
-    def make_frame(t):
-        frame = clip.get_frame(t)
-        alpha = 1.0
+    """
+    应用淡入淡出效果
+
+    只有淡入淡出期间的帧用查找表调暗，其余帧原样返回，不做任何计算
+    """
+    def make_frame(get_frame, t):
+        frame = get_frame(t)
         
         # 淡入
         if t < fade_in_duration:
-            alpha = t / fade_in_duration
+            return fade_frame(frame, t / fade_in_duration)
         # 淡出
-        elif t > clip.duration - fade_out_duration:
-            alpha = (clip.duration - t) / fade_out_duration
+        if t > clip.duration - fade_out_duration:
+            return fade_frame(frame, (clip.duration - t) / fade_out_duration)
         
-        return (frame * alpha).astype('uint8')
+        return frame
     
     return clip.transform(make_frame)
 
+# 可用的文本字体：未解析时为_UNRESOLVED，解析后为字体名，全部不可用时为None
+_UNRESOLVED = object()
+_text_font = _UNRESOLVED
+
+def resolve_text_font():
+    """找出第一个能创建文本片段的字体（只尝试一次，之后直接使用结果）"""
+    global _text_font
+    if _text_font is _UNRESOLVED:
+        _text_font = None
+        for font_name in TEXT_FONTS:
+            try:
+                TextClip(text="测试", font_size=20, font=font_name).close()
+            except Exception:
+                continue
+            _text_font = font_name
+            break
+        if _text_font is None:
+            print("  警告: 没有可用的文本字体，将跳过文本显示")
+    return _text_font
+
 def create_text_clip(text, font_size, color='white', position='center', duration=1):
     """创建文本片段"""
     if not text:
@@ -76,34 +89,98 @@ def create_text_clip(text, font_size, color='white', position='center', duration
     # 转换文本为字符串
     text = str(text)
     
-    try:
-        # 首先尝试使用系统字体
-        fonts_to_try = ['SimHei', 'Microsoft-YaHei', 'Microsoft-YaHei-UI', 'SimSun', 'Arial-Unicode-MS']
-        
-        for font_name in fonts_to_try:
-            try:
-                txt_clip = TextClip(
-                    text=text, 
-                    font_size=font_size, 
-                    color=color,
-                    font=font_name,
-                    size=(VIDEO_WIDTH - 200, None),
-                    method='caption',
-                    text_align='center'
-                )
-                txt_clip = txt_clip.with_position(position).with_duration(duration)
-                return txt_clip
-            except Exception:
-                continue
-        
-        # 如果所有字体都失败，返回None
-        print(f"  警告: 无法创建文本片段 '{text}'，跳过文本显示")
+    font_name = resolve_text_font()
+    if font_name is None:
         return None
-        
+    
+    try:
+        txt_clip = TextClip(
+            text=text, 
+            font_size=font_size, 
+            color=color,
+            font=font_name,
+            size=(VIDEO_WIDTH - 200, None),
+            method='caption',
+            text_align='center'
+        )
+        return txt_clip.with_position(position).with_duration(duration)
     except Exception as e:
         print(f"  警告: 无法创建文本片段 '{text}': {e}")
         return None
 
+def render_line_frame(bg_frame, title, desc):
+    """把背景和标题、描述文本合成为一张静态画面（每条语音只合成一次，不再逐帧合成）"""
+    composite_clips = [ImageClip(bg_frame)]
+    
+    # 添加标题（如果有）
+    if title:
+        title_clip = create_text_clip(
+            title, 
+            font_size=60, 
+            color='white',
+            position=('center', VIDEO_HEIGHT * 0.7)
+        )
+        if title_clip:
+            composite_clips.append(title_clip)
+    
+    # 添加描述（如果有）
+    if desc:
+        desc_clip = create_text_clip(
+            desc, 
+            font_size=40, 
+            color='white',
+            position=('center', VIDEO_HEIGHT * 0.85)
+        )
+        if desc_clip:
+            composite_clips.append(desc_clip)
+    
+    composite = CompositeVideoClip(composite_clips, size=(VIDEO_WIDTH, VIDEO_HEIGHT))
+    try:
+        return composite.get_frame(0)
+    finally:
+        composite.close()
+        for clip in composite_clips:
+            clip.close()
+
+def iter_line_segments(voice_files, durations, voice_index, bg_frame):
+    """
+    按顺序逐个生成角色的片段：每条语音一个带文字的静态画面，之后跟一个间隔片段
+
+    Yields:
+        片段dict：image、duration、audio（间隔片段为None）
+    """
+    for voice_file in voice_files:
+        voice_id = voice_file.stem  # 不含扩展名的文件名
+        
+        # 获取对应的文本
+        title, desc = get_voice_text(voice_index, voice_id)
+        
+        print(f"  处理: {voice_id}")
+        print(f"    标题: {title}")
+        print(f"    描述: {desc}")
+        
+        try:
+            if voice_file in durations:
+                # 直接使用文件头中的时长，不需要打开音频
+                audio_duration = durations[voice_file]
+            else:
+                audio = AudioFileClip(str(voice_file))
+                audio_duration = audio.duration
+                audio.close()
+            
+            frame = render_line_frame(bg_frame, title, desc)
+        except Exception as e:
+            print(f"  处理语音文件失败: {voice_file}, 错误: {e}")
+            continue
+        
+        # 背景片段只使用音频时长，不包括间隔
+        yield {'image': frame, 'duration': audio_duration, 'audio': str(voice_file)}
+        del frame
+        
+        # 如果需要添加间隔，创建一个静音片段（只有图片，没有音频）
+        if INTERVAL_DURATION > 0:
+            yield {'image': bg_frame, 'duration': INTERVAL_DURATION, 'audio': None}
+
 def create_video_for_character(char_id, character_data):
     """为单个角色创建视频"""
     print(f"\n开始处理角色: {char_id}")
@@ -129,8 +206,8 @@ def create_video_for_character(char_id, character_data):
     
     print(f"找到 {len(voice_files)} 个语音文件")
     
-    # 创建视频片段列表
-    clips = []
+    # 只读取文件头获取所有语音时长
+    durations = probe_folder(char_dir, '*.mp3')
     
     # 加载背景图片
     try:
@@ -146,90 +223,49 @@ def create_video_for_character(char_id, character_data):
             width=VIDEO_WIDTH, 
             height=VIDEO_HEIGHT
         )
+        # 缩放裁剪只做一次，之后所有片段直接使用这张画面
+        bg_frame = bg_image.get_frame(0)
+        bg_image.close()
     except Exception as e:
         print(f"加载图片失败: {e}")
         return False
     
-    # 处理每个语音文件
-    for voice_file in voice_files:
-        voice_id = voice_file.stem  # 不含扩展名的文件名
-        
-        # 获取对应的文本
-        title, desc = get_voice_text(character_data, voice_id)
-        
-        print(f"  处理: {voice_id}")
-        print(f"    标题: {title}")
-        print(f"    描述: {desc}")
-        
-        try:
-            # 加载音频
-            audio = AudioFileClip(str(voice_file))
-            audio_duration = audio.duration
-            
-            # 计算这段视频的总时长（音频时长 + 间隔）
-            segment_duration = audio_duration + INTERVAL_DURATION
-            
-            # 创建背景图片片段 - 使用音频时长，不包括间隔
-            bg_clip = bg_image.with_duration(audio_duration)
-            
-            # 创建文本片段
-            composite_clips = [bg_clip]
-            
-            # 添加标题（如果有）
-            if title:
-                title_clip = create_text_clip(
-                    title, 
-                    font_size=60, 
-                    color='white',
-                    position=('center', VIDEO_HEIGHT * 0.7),
-                    duration=audio_duration
-                )
-                if title_clip:
-                    composite_clips.append(title_clip)
-            
-            # 添加描述（如果有）
-            if desc:
-                desc_clip = create_text_clip(
-                    desc, 
-                    font_size=40, 
-                    color='white',
-                    position=('center', VIDEO_HEIGHT * 0.85),
-                    duration=audio_duration
-                )
-                if desc_clip:
-                    composite_clips.append(desc_clip)
-            
-            # 合成视频片段 - 只使用音频时长
-            segment = CompositeVideoClip(composite_clips, size=(VIDEO_WIDTH, VIDEO_HEIGHT))
-            segment = segment.with_audio(audio)
-            segment = segment.with_duration(audio_duration)
-            
-            # 如果需要添加间隔，创建一个静音片段
-            if INTERVAL_DURATION > 0:
-                # 创建间隔片段（只有图片，没有音频）
-                interval_clip = bg_image.with_duration(INTERVAL_DURATION)
-                clips.append(segment)
-                clips.append(interval_clip)
-            else:
-                clips.append(segment)
-            
-        except Exception as e:
-            print(f"  处理语音文件失败: {voice_file}, 错误: {e}")
-            continue
+    # 建立语音文本索引（每个角色只建立一次）
+    voice_index = build_voice_index(character_data)
+    report_voice_coverage(voice_index, [f.stem for f in voice_files])
     
-    if not clips:
+    # 每条语音的画面（背景+文本）只合成一次
+    segments = iter_line_segments(voice_files, durations, voice_index, bg_frame)
+    first_segment = next(segments, None)
+    if first_segment is None:
         print("没有成功创建任何视频片段")
         return False
-    
-    # 合并所有片段
-    print(f"合并 {len(clips)} 个视频片段...")
-    final_video = concatenate_videoclips(clips, method="compose")
+    segments = itertools.chain([first_segment], segments)
     
     # 输出视频
     output_dir = char_dir / "output_videos"
     output_dir.mkdir(exist_ok=True)
     output_path = output_dir / f"{char_id}_complete.mp4"
     
+    if USE_STILL_ENCODER:
+        print(f"快速导出静态片段: {output_path}")
+        count = encode_still_timeline(segments, output_path, fps=FPS, codec='libx264',
+                                      preset='medium', audio_codec='aac')
+        print(f"✓ 视频创建成功: {output_path}（{count} 个片段）")
+        return True
+    
+    # MoviePy导出：片段已是静态画面，只需按时长重复并附上语音
+    clips = []
+    for segment in segments:
+        clip = ImageClip(segment['image']).with_duration(segment['duration'])
+        if segment['audio']:
+            clip = clip.with_audio(AudioFileClip(segment['audio']))
+        clips.append(clip)
+    
+    # 合并所有片段
+    print(f"合并 {len(clips)} 个视频片段...")
+    final_video = concatenate_videoclips(clips, method="compose")
+    
     print(f"正在导出视频: {output_path}")
     final_video.write_videofile(
         str(output_path),
@@ -241,7 +277,8 @@ def create_video_for_character(char_id, character_data):
     
     # 清理资源
     final_video.close()
-    bg_image.close()
+    for clip in clips:
+        clip.close()
     
     print(f"✓ 视频创建成功: {output_path}")
     return True
@@ -1,12 +1,29 @@
+import argparse
+import itertools
 import json
+import multiprocessing
 import os
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 try:
     from moviepy import ImageClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips
 except ImportError:
     from moviepy.editor import ImageClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from font_registry import get_font, resolve_all_fonts
+from text_wrap import wrap_paragraph
+from compositing import blend_rgba
+from voice_index import build_voice_index, diff_voice_tables, get_voice_text, report_voice_coverage
+from audio_probe import probe_folder
+from build_manifest import character_inputs, load_manifest, plan_builds, save_manifest
+from panel_bake import load_character_panel
+from shared_layers import attach_layers, get_layer, publish_layers, release_layers
+from video_export import encode_still_timeline, encode_segments_parallel, write_audio_track
 
 # 增加PIL图片大小限制
 Image.MAX_IMAGE_PIXELS = None
@@ -16,82 +33,45 @@ VIDEO_WIDTH = 1920
 VIDEO_HEIGHT = 1080
 FPS = 30
 INTERVAL_DURATION = 1.0  # 文本之间的间隔
+USE_STILL_ENCODER = True  # 静态帧快速导出：每张画面只交给ffmpeg一次，跳过MoviePy逐帧渲染
+SEGMENT_JOBS = os.cpu_count() or 1  # 快速导出时并行编码的片段数，大于1时各片段并行编码后无损拼接
+AUDIO_PASSTHROUGH = True  # 快速导出时直接复制MP3音频帧，不重新编码为AAC
 
 # 路径设置
 BASE_DIR = Path(__file__).parent
 CHARACTER_IMAGE_DIR = BASE_DIR / "CharacterImage"
 CHARACTER_TABLE_PATH = BASE_DIR / "CharacterTable.json"
+PANEL_CACHE_DIR = BASE_DIR / "panel_cache"  # 缩放裁剪好的角色面板缓存（避免每次完整解码超大原图），None为不缓存
+SEGMENT_CACHE_DIR = BASE_DIR / "segment_cache"  # 已编码片段的缓存（崩溃后重跑直接复用），None为不缓存
+BUILD_MANIFEST_PATH = BASE_DIR / "video_manifest.json"  # 记录每个视频的输入指纹，输入没变的角色不再重新生成
 
-def load_character_data():
+def load_character_data(path=CHARACTER_TABLE_PATH):
     """加载角色数据"""
-    with open(CHARACTER_TABLE_PATH, 'r', encoding='utf-8') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data
 
-def get_voice_text(character_data, voice_id):
-    """根据语音ID获取对应的标题和描述"""
-    # 尝试从profileVoice获取
-    profile_voices = character_data.get('profileVoice', [])
-    for voice in profile_voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    # 如果profileVoice找不到，尝试voices
-    voices = character_data.get('voices', [])
-    for voice in voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    return "", ""
-
 def create_text_image(text, font_size, width, height, y_offset, x_offset=None, max_width=None, font_name='simhei'):
-    """使用PIL创建文本图像，支持自动换行和指定字体"""
+    """
+    使用PIL创建文本图像，支持自动换行和指定字体
+
+    只在文字实际占用的范围内生成RGBA图块，而不是整个画面大小的透明画布
+
+    Returns:
+        (图块, (x, y))：RGBA图块（numpy数组）及其左上角在画面中的位置，
+        没有可绘制的文字时返回None
+    """
     if not text:
         return None
     
     # 转换为字符串
     text = str(text)
     
-    # 创建RGBA背景（透明）
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    
-    # 尝试加载指定字体
-    font = None
+    # 仅用于测量文字的临时画板
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
     
-    if font_name.lower() == 'noto serif':
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.ttf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.otf"), font_size)
-            except:
-                pass
-    elif font_name.lower() == 'noto sans':
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSansSC-Regular.ttf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype(os.path.join("Fonts", "NotoSansSC-Regular.otf"), font_size)
-            except:
-                pass
-    
-    # 如果指定字体未找到，使用默认字体
-    if font is None:
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.otf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype("C:/Windows/Fonts/msyh.ttc", font_size)
-            except:
-                try:
-                    font = ImageFont.truetype("C:/Windows/Fonts/simsun.ttc", font_size)
-                except:
-                    font = ImageFont.load_default()
+    # 从字体注册表获取共享的字体对象
+    font = get_font(font_name, font_size)
     
     # 确定最大宽度
     if max_width is None:
@@ -104,22 +84,7 @@ def create_text_image(text, font_size, width, height, y_offset, x_offset=None, m
             lines.append('')
             continue
         
-        current_line = ''
-        for char in paragraph:
-            test_line = current_line + char
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            line_width = bbox[2] - bbox[0]
-            
-            if line_width > max_width:
-                if current_line:
-                    lines.append(current_line)
-                    current_line = char
-                else:
-                    lines.append(char)
-            else:
-                current_line = test_line
-        if current_line:
-            lines.append(current_line)
+        lines.extend(wrap_paragraph(paragraph, font, max_width, draw))
     
     # 计算行高
     bbox = draw.textbbox((0, 0), "測", font=font)
@@ -139,16 +104,135 @@ def create_text_image(text, font_size, width, height, y_offset, x_offset=None, m
     if x < 20:
         x = 20
     
-    # 绘制每一行文本（黑色文本，不带阴影和描边）
+    # 计算每一行的位置和整个文字块的范围
+    placements = []
     for line in lines:
-        # 直接绘制黑色文本
-        draw.text((x, y), line, font=font, fill=(0, 0, 0, 255))
+        if line:
+            placements.append((y, line, draw.textbbox((x, y), line, font=font)))
         y += line_height
+
+    if not placements:
+        return None
+
+    left = min(bbox[0] for _, _, bbox in placements)
+    top = min(bbox[1] for _, _, bbox in placements)
+    right = max(bbox[2] for _, _, bbox in placements)
+    bottom = max(bbox[3] for _, _, bbox in placements)
+
+    # 绘制每一行文本（坐标换算到图块内，不带阴影和描边）
+    img = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+    tile_draw = ImageDraw.Draw(img)
+    for line_y, line, _ in placements:
+        tile_draw.text((x - left, line_y - top), line, font=font, fill=(0, 0, 0, 255))
+
+    return np.array(img), (left, top)
+
+def load_section_background():
+    """
+    加载缩放到视频尺寸的Section_BG.png（所有角色共用的底图，RGB数组）
+
+    批量并行时主进程只解码一次并放入共享内存，子进程直接使用只读视图；
+    返回值可能是只读的，需要修改时先复制
+    """
+    shared = get_layer('section_bg')
+    if shared is not None:
+        return shared
     
-    return np.array(img)
+    try:
+        bg_path = BASE_DIR / "Section_BG.png"
+        final_img = Image.open(bg_path).convert('RGB')
+        final_img = final_img.resize((VIDEO_WIDTH, VIDEO_HEIGHT), Image.LANCZOS)
+    except:
+        # 如果加载失败，使用黑色背景
+        print("  警告: 无法加载 Section_BG.png，使用黑色背景")
+        final_img = Image.new('RGB', (VIDEO_WIDTH, VIDEO_HEIGHT), (0, 0, 0))
+    return np.array(final_img)
+
+# 子进程开始处理角色时把角色ID放入这个队列，进程池损坏时据此找出可能导致崩溃的角色
+_started_queue = None
+
+def init_worker(layer_specs, started_queue=None):
+    """批量并行时每个子进程的初始化：解析字体、连接共享底图并记录开始处理的角色"""
+    global _started_queue
+    resolve_all_fonts()
+    attach_layers(layer_specs)
+    _started_queue = started_queue
+
+def iter_line_segments(voice_files, durations, voice_index, bg_array):
+    """
+    按顺序逐个生成角色的片段：每条语音一个带文字的画面片段，之后跟一个间隔片段
+
+    生成器每次只合成一张画面，调用方写出后即可释放
+
+    Args:
+        voice_files: 语音文件列表
+        durations: 语音文件 -> 从文件头读取的时长（秒），缺少的文件会打开音频获取
+        voice_index: 语音文本索引
+        bg_array: 已合成角色图片的背景画面（所有间隔片段共用）
+
+    Yields:
+        片段dict：image、duration、audio（间隔片段为None）
+    """
+    for voice_file in voice_files:
+        voice_id = voice_file.stem
+        
+        # 获取对应的文本
+        title, desc = get_voice_text(voice_index, voice_id)
+        
+        if title or desc:  # 只显示有文本的语音
+            print(f"  处理: {voice_id}")
+            if title:
+                print(f"    标题: {title}")
+            if desc:
+                print(f"    描述: {desc}")
+        
+        try:
+            if voice_file in durations:
+                # 直接使用文件头中的时长，不需要打开音频
+                audio_duration = durations[voice_file]
+            else:
+                # 文件头无法解析时才打开音频获取时长
+                audio = AudioFileClip(str(voice_file))
+                audio_duration = audio.duration
+                audio.close()
+            
+            # 创建包含文本的背景图像
+            composite_img = bg_array.copy()
+            
+            # 文本显示在右侧，从宽度53%开始
+            text_x_start = int(VIDEO_WIDTH * 0.53)
+            
+            # 添加标题（使用Noto Serif，字号80，位置在30%）
+            if title:
+                text_img = create_text_image(title, 80, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.30), x_offset=text_x_start, max_width=800, font_name='noto serif')
+                if text_img is not None:
+                    # 合成图像（处理透明度）
+                    blend_rgba(composite_img, *text_img)
+            
+            # 添加描述（使用Noto Sans，字号40，位置在55%）
+            if desc:
+                text_img = create_text_image(str(desc), 40, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.55), x_offset=text_x_start, max_width=800, font_name='noto sans')
+                if text_img is not None:
+                    # 合成图像（处理透明度）
+                    blend_rgba(composite_img, *text_img)
+        except Exception as e:
+            print(f"  处理语音文件失败: {voice_file}, 错误: {e}")
+            continue
+        
+        # 画面、时长和音频路径（导出时直接使用，音轨也据此预先混好）
+        yield {'image': composite_img, 'duration': audio_duration, 'audio': str(voice_file)}
+        del composite_img
+        
+        # 添加间隔（所有间隔共用同一张背景，只写入一次）
+        if INTERVAL_DURATION > 0:
+            yield {'image': bg_array, 'duration': INTERVAL_DURATION, 'audio': None}
 
-def create_video_for_character(char_id, character_data):
-    """为单个角色创建视频"""
+def create_video_for_character(char_id, character_data, thread_budget=None):
+    """
+    为单个角色创建视频
+
+    thread_budget: 该角色可用的ffmpeg编码线程数（批量并行时由调度器分配），None表示不限制
+    """
     print(f"\n开始处理角色: {char_id}")
     
     # 获取角色文件夹和图片路径
@@ -172,52 +256,28 @@ def create_video_for_character(char_id, character_data):
     
     print(f"找到 {len(voice_files)} 个语音文件")
     
-    # 创建视频片段列表
-    clips = []
+    # 只读取文件头获取所有语音时长，解码前就能确定时间线
+    durations = probe_folder(char_dir, '*.mp3')
+    
+    # 每个语音文件都会编码为一个片段（没有文本的语音只显示背景），之后跟一个间隔
+    probed_files = [f for f in voice_files if f in durations]
+    if probed_files:
+        planned = sum(durations[f] for f in probed_files) + INTERVAL_DURATION * len(voice_files)
+        unknown = len(voice_files) - len(probed_files)
+        # 文件头无法解析的语音导出时才能得到时长，未计入预计时长
+        note = f"（{unknown} 个语音文件的时长未知，未计入）" if unknown else ""
+        print(f"预计视频时长: {planned:.1f} 秒{note}")
     
     # 加载背景和角色图片
     try:
-        # 加载角色图片
-        char_img = Image.open(str(image_path)).convert('RGB')
+        # 加载角色面板（角色图片宽度为总宽度的50%，已缩放裁剪的面板会被缓存）
+        char_img = load_character_panel(image_path, (VIDEO_WIDTH // 2, VIDEO_HEIGHT), PANEL_CACHE_DIR)
         
-        # 角色图片宽度为总宽度的50%
-        char_img_width = VIDEO_WIDTH // 2
-        char_img_height = VIDEO_HEIGHT
-        
-        # 调整角色图片大小
-        img_width, img_height = char_img.size
-        aspect_ratio = img_width / img_height
-        target_aspect = char_img_width / char_img_height
-        
-        if aspect_ratio > target_aspect:
-            # 图片太宽
-            new_height = char_img_height
-            new_width = int(char_img_height * aspect_ratio)
-            left = (new_width - char_img_width) // 2
-            char_img = char_img.resize((new_width, new_height), Image.LANCZOS)
-            char_img = char_img.crop((left, 0, left + char_img_width, new_height))
-        else:
-            # 图片太高
-            new_width = char_img_width
-            new_height = int(char_img_width / aspect_ratio)
-            top = (new_height - char_img_height) // 2
-            char_img = char_img.resize((new_width, new_height), Image.LANCZOS)
-            char_img = char_img.crop((0, top, new_width, top + char_img_height))
-        
-        # 创建最终图像：使用Section_BG.png作为背景
-        try:
-            bg_path = BASE_DIR / "Section_BG.png"
-            final_img = Image.open(bg_path).convert('RGB')
-            final_img = final_img.resize((VIDEO_WIDTH, VIDEO_HEIGHT), Image.LANCZOS)
-        except:
-            # 如果加载失败，使用黑色背景
-            print("  警告: 无法加载 Section_BG.png，使用黑色背景")
-            final_img = Image.new('RGB', (VIDEO_WIDTH, VIDEO_HEIGHT), (0, 0, 0))
+        # 创建最终图像：使用Section_BG.png作为背景（并行时直接使用主进程共享的底图）
+        bg_array = load_section_background().copy()
         
         # 将角色图片粘贴到左侧
-        final_img.paste(char_img, (0, 0))
-        
-        bg_array = np.array(final_img)
+        bg_array[:char_img.height, :char_img.width] = np.asarray(char_img)
         
     except Exception as e:
         print(f"加载图片失败: {e}")
@@ -225,101 +285,179 @@ def create_video_for_character(char_id, character_data):
         traceback.print_exc()
         return False
     
-    # 处理每个语音文件
-    for voice_file in voice_files:
-        voice_id = voice_file.stem
-        
-        # 获取对应的文本
-        title, desc = get_voice_text(character_data, voice_id)
-        
-        if title or desc:  # 只显示有文本的语音
-            print(f"  处理: {voice_id}")
-            if title:
-                print(f"    标题: {title}")
-            if desc:
-                print(f"    描述: {desc}")
-        
-        try:
-            # 加载音频
-            audio = AudioFileClip(str(voice_file))
-            audio_duration = audio.duration
-            
-            # 创建包含文本的背景图像
-            composite_img = bg_array.copy()
-            
-            # 文本显示在右侧，从宽度53%开始
-            text_x_start = int(VIDEO_WIDTH * 0.53)
-            
-            # 添加标题（使用Noto Serif，字号80，位置在30%）
-            if title:
-                text_img = create_text_image(title, 80, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.30), x_offset=text_x_start, max_width=800, font_name='noto serif')
-                if text_img is not None:
-                    # 合成图像（处理透明度）
-                    alpha = text_img[:,:,3] / 255.0
-                    for c in range(3):
-                        composite_img[:,:,c] = composite_img[:,:,c] * (1 - alpha) + text_img[:,:,c] * alpha
-            
-            # 添加描述（使用Noto Sans，字号40，位置在55%）
-            if desc:
-                text_img = create_text_image(str(desc), 40, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.55), x_offset=text_x_start, max_width=800, font_name='noto sans')
-                if text_img is not None:
-                    # 合成图像（处理透明度）
-                    alpha = text_img[:,:,3] / 255.0
-                    for c in range(3):
-                        composite_img[:,:,c] = composite_img[:,:,c] * (1 - alpha) + text_img[:,:,c] * alpha
-            
-            # 创建视频片段
-            video_clip = ImageClip(composite_img).with_duration(audio_duration)
-            video_clip = video_clip.with_audio(audio)
-            
-            clips.append(video_clip)
-            
-            # 添加间隔
-            if INTERVAL_DURATION > 0:
-                interval_clip = ImageClip(bg_array).with_duration(INTERVAL_DURATION)
-                clips.append(interval_clip)
-            
-        except Exception as e:
-            print(f"  处理语音文件失败: {voice_file}, 错误: {e}")
-            continue
+    # 建立语音文本索引（每个角色只建立一次）
+    voice_index = build_voice_index(character_data)
+    report_voice_coverage(voice_index, [f.stem for f in voice_files])
     
-    if not clips:
+    # 片段按需逐个生成：快速导出时每个片段写出后即释放画面，内存占用与语音数量无关
+    segments = iter_line_segments(voice_files, durations, voice_index, bg_array)
+    first_segment = next(segments, None)
+    if first_segment is None:
         print("没有成功创建任何视频片段")
         return False
-    
-    # 合并所有片段
-    print(f"合并 {len(clips)} 个视频片段...")
-    final_video = concatenate_videoclips(clips, method="compose")
+    segments = itertools.chain([first_segment], segments)
     
     # 输出视频
     output_dir = char_dir / "output_videos"
     output_dir.mkdir(exist_ok=True)
     output_path = output_dir / f"{char_id}_complete.mp4"
     
-    print(f"正在导出视频: {output_path}")
-    final_video.write_videofile(
-        str(output_path),
-        fps=FPS,
-        codec='libx264',
-        audio_codec='aac',
-        preset='medium',
-        threads=4
-    )
-    
-    # 清理资源
-    final_video.close()
-    for clip in clips:
-        clip.close()
+    # 编码线程数：批量并行时不超过分配给该角色的线程预算
+    ffmpeg_threads = thread_budget or 4
+    segment_jobs = SEGMENT_JOBS if thread_budget is None else min(SEGMENT_JOBS, thread_budget)
+    
+    if USE_STILL_ENCODER:
+        audio_codec = 'copy' if AUDIO_PASSTHROUGH else 'aac'
+        if segment_jobs > 1 or SEGMENT_CACHE_DIR is not None:
+            # 按片段编码：可以并行，也可以缓存已编码的片段
+            print(f"分片段导出静态片段（{segment_jobs} 路）: {output_path}")
+            segment_threads = max(1, thread_budget // segment_jobs) if thread_budget else None
+            count = encode_segments_parallel(segments, output_path, fps=FPS, codec='libx264', preset='medium',
+                                             audio_codec=audio_codec, jobs=segment_jobs, threads=segment_threads,
+                                             cache_dir=SEGMENT_CACHE_DIR)
+        else:
+            print(f"快速导出静态片段: {output_path}")
+            count = encode_still_timeline(segments, output_path, fps=FPS, codec='libx264', preset='medium',
+                                          audio_codec=audio_codec, threads=ffmpeg_threads)
+        print(f"✓ 视频创建成功: {output_path}（{count} 个片段）")
+        return True
+    
+    # MoviePy导出需要同时持有所有片段
+    segments = list(segments)
+    clips = [ImageClip(segment['image']).with_duration(segment['duration']) for segment in segments]
+    
+    # 合并所有片段
+    print(f"合并 {len(clips)} 个视频片段...")
+    final_video = concatenate_videoclips(clips, method="compose")
+    
+    with tempfile.TemporaryDirectory(prefix="audio_track_") as temp_dir:
+        # 所有语音预先混成一条音轨，导出时只有一个音频读取进程
+        audio_path = write_audio_track(segments, [segment['duration'] for segment in segments],
+                                       os.path.join(temp_dir, "audio.wav"))
+        audio_track = AudioFileClip(audio_path)
+        final_video = final_video.with_audio(audio_track)
+        
+        try:
+            print(f"正在导出视频: {output_path}")
+            final_video.write_videofile(
+                str(output_path),
+                fps=FPS,
+                codec='libx264',
+                audio_codec='aac',
+                preset='medium',
+                threads=ffmpeg_threads
+            )
+        finally:
+            # 清理资源（删除临时目录前先关闭音轨）
+            audio_track.close()
+            final_video.close()
+            for clip in clips:
+                clip.close()
     
     print(f"✓ 视频创建成功: {output_path}")
     return True
 
-def main():
+def build_target(char_id, character_data):
+    """角色视频的输出路径及其依赖的输入指纹（用于增量生成）"""
+    char_dir = BASE_DIR / char_id
+    output_path = char_dir / "output_videos" / f"{char_id}_complete.mp4"
+    settings = {
+        'size': [VIDEO_WIDTH, VIDEO_HEIGHT],
+        'fps': FPS,
+        'interval': INTERVAL_DURATION,
+        'audio_passthrough': AUDIO_PASSTHROUGH,
+    }
+    inputs = character_inputs(character_data, CHARACTER_IMAGE_DIR / f"{char_id}.jpg", char_dir,
+                              BASE_DIR / "Section_BG.png", settings)
+    return output_path, inputs
+
+def plan_patch(old_table_path, all_data, character_ids):
+    """
+    补丁模式：与旧版CharacterTable比较，返回语音文本有变化的角色
+
+    未变化的语音片段由片段缓存直接复用，只有文本变化的片段重新编码，
+    再与其余片段一起复制视频流拼接，其余部分与原视频完全相同
+    """
+    print(f"\n比较旧版角色数据: {old_table_path}")
+    changes = diff_voice_tables(load_character_data(old_table_path), all_data)
+    
+    patched_ids = [char_id for char_id in character_ids if char_id in changes]
+    for char_id in patched_ids:
+        print(f"  {char_id}: {len(changes[char_id])} 条语音有变化: {', '.join(changes[char_id])}")
+    print(f"补丁计划: {len(patched_ids)} 个角色需要更新，{len(character_ids) - len(patched_ids)} 个没有变化")
+    
+    if patched_ids and SEGMENT_CACHE_DIR is None:
+        print("  警告: 未启用片段缓存，受影响的角色会完整重新生成")
+    return patched_ids
+
+def render_character(char_id, character_data, thread_budget=None):
+    """批量任务的单个角色入口：异常只影响当前角色，返回(角色ID, 是否成功)"""
+    try:
+        return char_id, create_video_for_character(char_id, character_data, thread_budget)
+    except Exception as e:
+        print(f"处理角色 {char_id} 时发生错误: {e}")
+        traceback.print_exc()
+        return char_id, False
+
+def render_character_in_worker(char_id, character_data, thread_budget=None):
+    """子进程中的角色入口：先登记开始处理的角色，再生成视频"""
+    if _started_queue is not None:
+        _started_queue.put(char_id)
+    return render_character(char_id, character_data, thread_budget)
+
+def drain_started(started_queue):
+    """取出队列中所有已开始处理的角色ID"""
+    started = set()
+    while not started_queue.empty():
+        started.add(started_queue.get())
+    return started
+
+def run_character_pool(char_ids, all_data, workers, thread_budget, layer_specs, started_queue, on_result):
+    """
+    在一个进程池中处理一批角色，每个角色完成后调用on_result(角色ID, 是否成功)
+
+    Returns:
+        有子进程异常退出（内存不足被杀、段错误等）导致进程池损坏时，
+        返回还没有结果的角色ID（按原顺序），否则返回空列表
+    """
+    unfinished = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(layer_specs, started_queue)) as executor:
+        futures = {
+            executor.submit(render_character_in_worker, char_id, all_data[char_id], thread_budget): char_id
+            for char_id in char_ids
+        }
+        for future in as_completed(futures):
+            char_id = futures[future]
+            try:
+                _, ok = future.result()
+            except BrokenProcessPool:
+                # 进程池损坏后所有未完成的任务都会收到这个异常，不能据此判断是哪个角色导致的
+                unfinished.add(char_id)
+                continue
+            except Exception as e:
+                print(f"处理角色 {char_id} 时发生错误: {e}")
+                ok = False
+            on_result(char_id, ok)
+    return [char_id for char_id in char_ids if char_id in unfinished]
+
+def main(argv=None):
     """主函数"""
+    parser = argparse.ArgumentParser(description="批量生成角色语音视频")
+    parser.add_argument('--jobs', type=int, default=1, help="同时处理的角色数（进程数），默认1")
+    parser.add_argument('--force', action='store_true', help="忽略构建清单，重新生成所有角色")
+    parser.add_argument('--patch', metavar='OLD_TABLE',
+                        help="与旧版CharacterTable.json比较，只更新语音文本有变化的角色和片段")
+    args = parser.parse_args(argv)
+    jobs = max(1, args.jobs)
+    
     print("=" * 60)
     print("开始批量生成角色语音视频")
     print("=" * 60)
     
+    # 解析字体（只解析一次，所有角色共用）
+    resolve_all_fonts()
+    
     # 加载角色数据
     print("\n加载角色数据...")
     all_data = load_character_data()
@@ -328,31 +466,89 @@ def main():
     character_ids = [key for key in all_data.keys() if key.startswith('chr_')]
     print(f"找到 {len(character_ids)} 个角色")
     
+    manifest = load_manifest(BUILD_MANIFEST_PATH)
+    targets = {char_id: build_target(char_id, all_data[char_id]) for char_id in character_ids}
+    if args.patch:
+        # 补丁模式：只更新文本有变化的角色
+        character_ids = plan_patch(args.patch, all_data, character_ids)
+    else:
+        # 根据构建清单，只生成输入有变化的角色
+        print("\n检查构建清单...")
+        character_ids = plan_builds(manifest, targets, force=args.force)
+    skipped_count = len(targets) - len(character_ids)
+    
+    def record_success(char_id):
+        # 每个角色完成后立即写入清单，中途崩溃也不会丢失已完成的记录
+        manifest[char_id] = targets[char_id][1]
+        save_manifest(BUILD_MANIFEST_PATH, manifest)
+    
     # 处理每个角色
     success_count = 0
     failed_count = 0
     
-    for i, char_id in enumerate(character_ids, 1):
-        print(f"\n[{i}/{len(character_ids)}] 处理角色: {char_id}")
+    if jobs == 1:
+        for i, char_id in enumerate(character_ids, 1):
+            print(f"\n[{i}/{len(character_ids)}] 处理角色: {char_id}")
+            
+            _, ok = render_character(char_id, all_data[char_id])
+            if ok:
+                record_success(char_id)
+                success_count += 1
+            else:
+                failed_count += 1
+    else:
+        # 每个进程分到的ffmpeg线程数，避免多个进程同时编码时超额占用CPU
+        thread_budget = max(1, (os.cpu_count() or 1) // jobs)
+        print(f"并行处理: {jobs} 个进程，每个进程 {thread_budget} 个编码线程")
         
-        character_data = all_data[char_id]
+        # 所有角色共用的底图只解码一次，通过共享内存交给各个进程（不在每个进程中各存一份）
+        layer_blocks, layer_specs = publish_layers({'section_bg': load_section_background()})
+        started_queue = multiprocessing.SimpleQueue()
+        finished_count = 0
         
-        try:
-            if create_video_for_character(char_id, character_data):
+        def record_result(char_id, ok):
+            nonlocal success_count, failed_count, finished_count
+            if ok:
+                record_success(char_id)
                 success_count += 1
             else:
                 failed_count += 1
-        except Exception as e:
-            print(f"处理角色 {char_id} 时发生错误: {e}")
-            import traceback
-            traceback.print_exc()
-            failed_count += 1
+            finished_count += 1
+            print(f"\n[{finished_count}/{len(character_ids)}] {'✓' if ok else '✗'} {char_id}")
+        
+        try:
+            pending = list(character_ids)
+            suspects = []
+            while pending or suspects:
+                if suspects:
+                    # 可能导致崩溃的角色单独放在一个进程中重试，再次崩溃就只能是这个角色自己的问题
+                    char_id = suspects.pop(0)
+                    if run_character_pool([char_id], all_data, 1, thread_budget, layer_specs,
+                                          started_queue, record_result):
+                        print(f"处理角色 {char_id} 时子进程异常退出")
+                        record_result(char_id, False)
+                    continue
+                
+                drain_started(started_queue)
+                batch, pending = pending, []
+                unfinished = run_character_pool(batch, all_data, jobs, thread_budget, layer_specs,
+                                                started_queue, record_result)
+                if unfinished:
+                    # 已经开始但没有完成的角色中有一个导致了崩溃，其余还没开始的角色换一个新进程池继续
+                    started = drain_started(started_queue)
+                    suspects = [char_id for char_id in unfinished if char_id in started] or unfinished
+                    pending = [char_id for char_id in unfinished if char_id not in suspects]
+                    print(f"\n有子进程异常退出：{len(suspects)} 个正在处理的角色将逐个重试，"
+                          f"其余 {len(pending)} 个角色重新排队")
+        finally:
+            release_layers(layer_blocks)
     
     # 输出统计信息
     print("\n" + "=" * 60)
     print("处理完成！")
     print(f"成功: {success_count} 个")
     print(f"失败: {failed_count} 个")
+    print(f"跳过: {skipped_count} 个（已是最新）")
     print("=" * 60)
 
 if __name__ == "__main__":
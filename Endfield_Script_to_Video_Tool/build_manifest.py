@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from font_registry import FONT_FILES, resolve_font_path
+
+# 各输入项的中文名称（用于打印构建计划）
+INPUT_NAMES = {
+    'character': "角色数据",
+    'image': "角色图片",
+    'voices': "语音文件",
+    'background': "背景图",
+    'fonts': "字体",
+    'settings': "输出参数",
+}
+
+
+def file_fingerprint(path):
+    """文件指纹：[大小, 修改时间]，文件不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def folder_fingerprint(folder, pattern):
+    """文件夹指纹：匹配文件的 [文件名, 大小, 修改时间] 列表"""
+    folder = Path(folder)
+    if not folder.exists():
+        return None
+    return [[path.name] + file_fingerprint(path) for path in sorted(folder.glob(pattern))]
+
+
+def fonts_fingerprint():
+    """所有已知字体族实际使用的字体文件及其指纹"""
+    fonts = []
+    for family, weight in sorted(FONT_FILES):
+        path = resolve_font_path(family, weight)
+        fonts.append([family, weight, path, file_fingerprint(path) if path else None])
+    return fonts
+
+
+def character_inputs(character_data, image_path, voice_dir, background_path, settings):
+    """收集一个角色的输出所依赖的全部输入指纹"""
+    character_json = json.dumps(character_data, ensure_ascii=False, sort_keys=True)
+    return {
+        'character': hashlib.sha256(character_json.encode('utf-8')).hexdigest(),
+        'image': file_fingerprint(image_path),
+        'voices': folder_fingerprint(voice_dir, '*.mp3'),
+        'background': file_fingerprint(background_path),
+        'fonts': fonts_fingerprint(),
+        'settings': settings,
+    }
+
+
+def load_manifest(path):
+    """读取构建清单，不存在或损坏时返回空清单"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    """写入构建清单（先写临时文件再替换，中途崩溃不会损坏清单）"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def stale_reasons(manifest, key, output_path, inputs):
+    """返回输出需要重新生成的原因列表，已是最新时返回空列表"""
+    if not Path(output_path).exists():
+        return ["输出不存在"]
+    recorded = manifest.get(key)
+    if recorded is None:
+        return ["没有构建记录"]
+    return [f"{INPUT_NAMES.get(name, name)}有变化" for name in inputs
+            if recorded.get(name) != inputs[name]]
+
+
+def plan_builds(manifest, targets, force=False):
+    """
+    根据构建清单确定需要重新生成的输出，并打印构建计划
+
+    Args:
+        manifest: 构建清单
+        targets: 输出键 -> (输出路径, 输入指纹)
+        force: 忽略清单，全部重新生成
+
+    Returns:
+        需要重新生成的输出键列表（保持targets中的顺序）
+    """
+    stale = []
+    for key, (output_path, inputs) in targets.items():
+        reasons = ["强制重新生成"] if force else stale_reasons(manifest, key, output_path, inputs)
+        if reasons:
+            stale.append(key)
+            print(f"  需要生成: {key}（{'、'.join(reasons)}）")
+
+    print(f"构建计划: {len(stale)} 个需要生成，{len(targets) - len(stale)} 个已是最新")
+    return stale
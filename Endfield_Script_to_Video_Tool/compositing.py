@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def alpha_bbox(alpha):
+    """返回alpha通道中非透明像素的范围 (top, bottom, left, right)，全透明时返回None"""
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(alpha.any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def blend_rgba(frame, layer, offset=(0, 0)):
+    """
+    将RGBA图层按alpha混合到画面上（原地修改frame）
+
+    只处理图层中非透明的区域，全程使用uint8/uint16整数运算，
+    开销与文字大小成正比，而不是与整个画面大小成正比
+
+    Args:
+        frame: 画面（numpy数组，HxWx3或HxWx4，uint8）
+        layer: RGBA图层（numpy数组，hxwx4，uint8）
+        offset: 图层左上角在画面中的位置 (x, y)
+    """
+    bbox = alpha_bbox(layer[:, :, 3])
+    if bbox is None:
+        return frame
+
+    top, bottom, left, right = bbox
+    x, y = offset
+
+    # 裁剪到画面范围内
+    frame_height, frame_width = frame.shape[:2]
+    top = max(top, -y)
+    left = max(left, -x)
+    bottom = min(bottom, frame_height - y)
+    right = min(right, frame_width - x)
+    if top >= bottom or left >= right:
+        return frame
+
+    src = layer[top:bottom, left:right]
+    dst = frame[y + top:y + bottom, x + left:x + right, :3]
+
+    alpha = src[:, :, 3:4].astype(np.uint16)
+    blended = (src[:, :, :3] * alpha + dst * (255 - alpha) + 127) // 255
+    dst[...] = blended
+    return frame
+
+
+# 亮度等级(0-255) -> uint8查找表，每个等级只计算一次
+_fade_luts = {}
+
+
+def fade_lut(level):
+    """亮度等级level(0-255)对应的查找表：像素值 -> 像素值*level/255（uint8）"""
+    lut = _fade_luts.get(level)
+    if lut is None:
+        lut = ((np.arange(256, dtype=np.uint16) * level + 127) // 255).astype(np.uint8)
+        _fade_luts[level] = lut
+    return lut
+
+
+def fade_frame(frame, alpha):
+    """
+    把画面按alpha(0-1)调暗（淡入淡出到黑色）
+
+    alpha为1时直接返回原画面，不做任何计算；其余情况查表得到新画面，不经过浮点运算
+    """
+    level = min(255, max(0, round(alpha * 255)))
+    if level == 255:
+        return frame
+    return fade_lut(level)[frame]
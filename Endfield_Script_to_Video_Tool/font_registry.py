@@ -0,0 +1,88 @@
+import os
+from PIL import ImageFont
+
+# 字体目录（相对于运行目录）
+FONT_DIR = "Fonts"
+
+# 字体候选文件：(字体族, 字重) -> 按优先级排列的字体文件
+FONT_FILES = {
+    ('noto serif', 'bold'): [
+        os.path.join(FONT_DIR, "NotoSerifSC-Bold.ttf"),
+        os.path.join(FONT_DIR, "NotoSerifSC-Bold.otf"),
+    ],
+    ('noto sans', 'regular'): [
+        os.path.join(FONT_DIR, "NotoSansSC-Regular.ttf"),
+        os.path.join(FONT_DIR, "NotoSansSC-Regular.otf"),
+    ],
+}
+
+# 每个字体族的默认字重
+DEFAULT_WEIGHTS = {
+    'noto serif': 'bold',
+    'noto sans': 'regular',
+}
+
+# 指定字体找不到时依次尝试的备用字体
+FALLBACK_FONT_FILES = [
+    os.path.join(FONT_DIR, "NotoSerifSC-Bold.otf"),
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simsun.ttc",
+]
+
+# 已解析的字体文件路径：(字体族, 字重) -> 路径（None表示使用PIL默认字体）
+_resolved_paths = {}
+
+# 已加载的字体对象：(字体族, 字重, 字号) -> ImageFont
+_font_cache = {}
+
+
+def _try_font_paths(paths):
+    """返回第一个能被PIL加载的字体文件路径"""
+    for path in paths:
+        try:
+            ImageFont.truetype(path, 12)
+            return path
+        except Exception:
+            continue
+    return None
+
+
+def resolve_font_path(family, weight=None):
+    """解析字体族对应的字体文件，每个(字体族, 字重)只解析一次"""
+    family = family.lower()
+    weight = (weight or DEFAULT_WEIGHTS.get(family, 'regular')).lower()
+    key = (family, weight)
+
+    if key not in _resolved_paths:
+        path = _try_font_paths(FONT_FILES.get(key, []))
+        if path is None:
+            path = _try_font_paths(FALLBACK_FONT_FILES)
+            if path is None:
+                print(f"  警告: 找不到字体 {family} {weight}，使用PIL默认字体")
+            else:
+                print(f"  警告: 找不到字体 {family} {weight}，使用备用字体 {path}")
+        _resolved_paths[key] = path
+
+    return _resolved_paths[key]
+
+
+def get_font(family, size, weight=None):
+    """获取共享的字体对象，每个(字体族, 字重, 字号)只从磁盘加载一次"""
+    family = family.lower()
+    weight = (weight or DEFAULT_WEIGHTS.get(family, 'regular')).lower()
+    key = (family, weight, size)
+
+    if key not in _font_cache:
+        path = resolve_font_path(family, weight)
+        if path is None:
+            _font_cache[key] = ImageFont.load_default()
+        else:
+            _font_cache[key] = ImageFont.truetype(path, size)
+
+    return _font_cache[key]
+
+
+def resolve_all_fonts():
+    """启动时一次性解析所有已知字体族，提前报告缺失的字体"""
+    for family, weight in FONT_FILES:
+        resolve_font_path(family, weight)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from build_manifest import file_fingerprint
+
+# 增加PIL图片大小限制
+Image.MAX_IMAGE_PIXELS = None
+
+# 缩放裁剪算法有变化时递增，使旧的缓存失效
+PANEL_CACHE_VERSION = 1
+
+
+def _panel_layout(source_size, panel_size):
+    """
+    按"覆盖后居中裁剪"计算缩放尺寸和裁剪框
+
+    Returns:
+        ((缩放宽, 缩放高), (左, 上, 右, 下))
+    """
+    img_width, img_height = source_size
+    panel_width, panel_height = panel_size
+    aspect_ratio = img_width / img_height
+    target_aspect = panel_width / panel_height
+
+    if aspect_ratio > target_aspect:
+        # 图片太宽
+        new_height = panel_height
+        new_width = int(panel_height * aspect_ratio)
+        left = (new_width - panel_width) // 2
+        return (new_width, new_height), (left, 0, left + panel_width, new_height)
+
+    # 图片太高
+    new_width = panel_width
+    new_height = int(panel_width / aspect_ratio)
+    top = (new_height - panel_height) // 2
+    return (new_width, new_height), (0, top, new_width, top + panel_height)
+
+
+def bake_panel(image_path, panel_size):
+    """
+    把角色原图缩放裁剪成指定大小的RGB面板
+
+    JPEG先用draft在解码时按1/2、1/4、1/8缩小（不低于最终缩放尺寸），
+    不再完整解码超大原图，再用LANCZOS完成最终缩放和裁剪
+    """
+    with Image.open(image_path) as img:
+        new_size, crop_box = _panel_layout(img.size, panel_size)
+        # 非JPEG图片不支持draft，会按原尺寸解码
+        img.draft('RGB', new_size)
+        img = img.convert('RGB')
+    panel = img.resize(new_size, Image.LANCZOS)
+    return panel.crop(crop_box)
+
+
+def _panel_cache_path(image_path, panel_size, cache_dir):
+    """面板缓存文件路径：由原图指纹和面板尺寸决定"""
+    payload = json.dumps([PANEL_CACHE_VERSION, str(Path(image_path).resolve()),
+                          file_fingerprint(image_path), list(panel_size)])
+    key = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    return Path(cache_dir) / f"{Path(image_path).stem}_{panel_size[0]}x{panel_size[1]}_{key}.png"
+
+
+def load_character_panel(image_path, panel_size, cache_dir=None):
+    """
+    读取角色面板，有缓存时直接使用，否则从原图生成并写入缓存
+
+    Args:
+        image_path: 角色原图路径
+        panel_size: 面板尺寸 (宽, 高)
+        cache_dir: 面板缓存文件夹，None为不缓存
+
+    Returns:
+        RGB面板图片（PIL Image）
+    """
+    if cache_dir is None:
+        return bake_panel(image_path, panel_size)
+
+    cache_path = _panel_cache_path(image_path, panel_size, cache_dir)
+    if cache_path.exists():
+        try:
+            with Image.open(cache_path) as cached:
+                return cached.convert('RGB')
+        except OSError:
+            print(f"  警告: 面板缓存损坏，重新生成: {cache_path.name}")
+
+    panel = bake_panel(image_path, panel_size)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再替换，并行生成同一面板时不会读到写了一半的文件
+    partial_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.partial.png")
+    panel.save(partial_path)
+    os.replace(partial_path, cache_path)
+    return panel
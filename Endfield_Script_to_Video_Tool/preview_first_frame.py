@@ -1,8 +1,15 @@
+import argparse
 import json
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import numpy as np
-import os
+
+from font_registry import get_font, resolve_all_fonts
+from text_wrap import wrap_paragraph
+from compositing import blend_rgba
+from voice_index import build_voice_index, get_voice_text, report_voice_coverage
+from build_manifest import character_inputs, load_manifest, plan_builds, save_manifest
+from panel_bake import load_character_panel
 
 # 设置参数
 VIDEO_WIDTH = 1920
@@ -13,6 +20,8 @@ BASE_DIR = Path(__file__).parent
 CHARACTER_IMAGE_DIR = BASE_DIR / "CharacterImage"
 CHARACTER_TABLE_PATH = BASE_DIR / "CharacterTable.json"
 PREVIEW_DIR = BASE_DIR / "preview_frames"
+PANEL_CACHE_DIR = BASE_DIR / "panel_cache"  # 与视频导出共用的角色面板缓存
+BUILD_MANIFEST_PATH = BASE_DIR / "preview_manifest.json"  # 记录每张预览图的输入指纹，输入没变的角色不再重新生成
 
 # 增加PIL图片大小限制
 Image.MAX_IMAGE_PIXELS = None
@@ -23,70 +32,27 @@ def load_character_data():
         data = json.load(f)
     return data
 
-def get_voice_text(character_data, voice_id):
-    """根据语音ID获取对应的标题和描述"""
-    # 尝试从profileVoice获取
-    profile_voices = character_data.get('profileVoice', [])
-    for voice in profile_voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    # 如果profileVoice找不到，尝试voices
-    voices = character_data.get('voices', [])
-    for voice in voices:
-        if voice.get('voId') == voice_id:
-            title = voice.get('voiceTitle', {}).get('id', '')
-            desc = voice.get('voiceDesc', {}).get('id', '')
-            return title, desc
-    
-    return "", ""
-
 def create_text_image(text, font_size, width, height, y_offset, x_offset=None, max_width=None, font_name='simhei'):
-    """使用PIL创建文本图像，支持自动换行和指定字体"""
+    """
+    使用PIL创建文本图像，支持自动换行和指定字体
+
+    只在文字实际占用的范围内生成RGBA图块，而不是整个画面大小的透明画布
+
+    Returns:
+        (图块, (x, y))：RGBA图块（numpy数组）及其左上角在画面中的位置，
+        没有可绘制的文字时返回None
+    """
     if not text:
         return None
     
     # 转换为字符串
     text = str(text)
     
-    # 创建透明背景
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
+    # 仅用于测量文字的临时画板
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
     
-    # 尝试加载指定字体
-    font = None
-    
-    if font_name.lower() == 'noto serif':
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.ttf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.otf"), font_size)
-            except:
-                pass
-    elif font_name.lower() == 'noto sans':
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSansSC-Regular.ttf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype(os.path.join("Fonts", "NotoSansSC-Regular.otf"), font_size)
-            except:
-                pass
-    
-    # 如果指定字体未找到，使用默认字体
-    if font is None:
-        try:
-            font = ImageFont.truetype(os.path.join("Fonts", "NotoSerifSC-Bold.otf"), font_size)
-        except:
-            try:
-                font = ImageFont.truetype("C:/Windows/Fonts/msyh.ttc", font_size)
-            except:
-                try:
-                    font = ImageFont.truetype("C:/Windows/Fonts/simsun.ttc", font_size)
-                except:
-                    font = ImageFont.load_default()
+    # 从字体注册表获取共享的字体对象
+    font = get_font(font_name, font_size)
     
     # 确定最大宽度
     if max_width is None:
@@ -99,23 +65,7 @@ def create_text_image(text, font_size, width, height, y_offset, x_offset=None, m
             lines.append('')
             continue
         
-        current_line = ''
-        for char in paragraph:
-            test_line = current_line + char
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            line_width = bbox[2] - bbox[0]
-            
-            if line_width > max_width:
-                if current_line:
-                    lines.append(current_line)
-                    current_line = char
-                else:
-                    lines.append(char)
-            else:
-                current_line = test_line
-        
-        if current_line:
-            lines.append(current_line)
+        lines.extend(wrap_paragraph(paragraph, font, max_width, draw))
     
     # 计算总高度
     line_height = font_size + 10  # 行间距
@@ -134,13 +84,28 @@ def create_text_image(text, font_size, width, height, y_offset, x_offset=None, m
     if x < 20:
         x = 20
     
-    # 绘制每一行文本（黑色文本，不带阴影和描边）
+    # 计算每一行的位置和整个文字块的范围
+    placements = []
     for line in lines:
-        # 直接绘制黑色文本
-        draw.text((x, y), line, font=font, fill=(30, 30, 30, 255))
+        if line:
+            placements.append((y, line, draw.textbbox((x, y), line, font=font)))
         y += line_height
-    
-    return np.array(img)
+
+    if not placements:
+        return None
+
+    left = min(bbox[0] for _, _, bbox in placements)
+    top = min(bbox[1] for _, _, bbox in placements)
+    right = max(bbox[2] for _, _, bbox in placements)
+    bottom = max(bbox[3] for _, _, bbox in placements)
+
+    # 绘制每一行文本（坐标换算到图块内，不带阴影和描边）
+    img = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+    tile_draw = ImageDraw.Draw(img)
+    for line_y, line, _ in placements:
+        tile_draw.text((x - left, line_y - top), line, font=font, fill=(30, 30, 30, 255))
+
+    return np.array(img), (left, top)
 
 def create_preview_frame(char_id, character_data):
     """为角色创建预览帧"""
@@ -161,9 +126,13 @@ def create_preview_frame(char_id, character_data):
     desc = ""
     voice_name = ""
     
+    # 建立语音文本索引（每个角色只建立一次）
+    voice_index = build_voice_index(character_data)
+    report_voice_coverage(voice_index, [f.stem for f in voice_files])
+    
     for voice_file in voice_files:
         voice_id = voice_file.stem
-        t, d = get_voice_text(character_data, voice_id)
+        t, d = get_voice_text(voice_index, voice_id)
         if t or d:  # 找到第一个有文本的
             title = t
             desc = d
@@ -181,32 +150,8 @@ def create_preview_frame(char_id, character_data):
         print(f"  描述: {desc}")
     
     try:
-        # 加载角色图片
-        char_img = Image.open(str(image_path)).convert('RGB')
-        
-        # 角色图片宽度为总宽度的50%
-        char_img_width = VIDEO_WIDTH // 2
-        char_img_height = VIDEO_HEIGHT
-        
-        # 调整角色图片大小
-        img_width, img_height = char_img.size
-        aspect_ratio = img_width / img_height
-        target_aspect = char_img_width / char_img_height
-        
-        if aspect_ratio > target_aspect:
-            # 图片太宽
-            new_height = char_img_height
-            new_width = int(char_img_height * aspect_ratio)
-            left = (new_width - char_img_width) // 2
-            char_img = char_img.resize((new_width, new_height), Image.LANCZOS)
-            char_img = char_img.crop((left, 0, left + char_img_width, new_height))
-        else:
-            # 图片太高
-            new_width = char_img_width
-            new_height = int(char_img_width / aspect_ratio)
-            top = (new_height - char_img_height) // 2
-            char_img = char_img.resize((new_width, new_height), Image.LANCZOS)
-            char_img = char_img.crop((0, top, new_width, top + char_img_height))
+        # 加载角色面板（角色图片宽度为总宽度的50%，已缩放裁剪的面板会被缓存）
+        char_img = load_character_panel(image_path, (VIDEO_WIDTH // 2, VIDEO_HEIGHT), PANEL_CACHE_DIR)
         
         # 创建最终图像：使用Section_BG.webp作为背景
         try:
@@ -229,17 +174,13 @@ def create_preview_frame(char_id, character_data):
         if title:
             text_img = create_text_image(title, 80, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.30), x_offset=text_x_start, max_width=800, font_name='noto serif')
             if text_img is not None:
-                alpha = text_img[:,:,3] / 255.0
-                for c in range(3):
-                    composite_img[:,:,c] = composite_img[:,:,c] * (1 - alpha) + text_img[:,:,c] * alpha
+                blend_rgba(composite_img, *text_img)
         
         # 添加描述（使用Noto Sans）- 距离标题更近
         if desc:
             text_img = create_text_image(str(desc), 40, VIDEO_WIDTH, VIDEO_HEIGHT, int(VIDEO_HEIGHT * 0.55), x_offset=text_x_start, max_width=800, font_name='noto sans')
             if text_img is not None:
-                alpha = text_img[:,:,3] / 255.0
-                for c in range(3):
-                    composite_img[:,:,c] = composite_img[:,:,c] * (1 - alpha) + text_img[:,:,c] * alpha
+                blend_rgba(composite_img, *text_img)
         
         # 保存预览图
         output_img = Image.fromarray(composite_img.astype('uint8'))
@@ -253,8 +194,19 @@ def create_preview_frame(char_id, character_data):
         print(f"  ✗ 错误: {e}")
         return False
 
-def main():
+def build_target(char_id, character_data):
+    """角色预览图的输出路径及其依赖的输入指纹（用于增量生成）"""
+    output_path = PREVIEW_DIR / f"{char_id}_preview.jpg"
+    inputs = character_inputs(character_data, CHARACTER_IMAGE_DIR / f"{char_id}.jpg", BASE_DIR / char_id,
+                              BASE_DIR / "Section_BG.webp", {'size': [VIDEO_WIDTH, VIDEO_HEIGHT]})
+    return output_path, inputs
+
+def main(argv=None):
     """主函数"""
+    parser = argparse.ArgumentParser(description="生成角色预览帧")
+    parser.add_argument('--force', action='store_true', help="忽略构建清单，重新生成所有预览图")
+    args = parser.parse_args(argv)
+    
     print("=" * 60)
     print("生成角色预览帧")
     print("=" * 60)
@@ -263,6 +215,9 @@ def main():
     PREVIEW_DIR.mkdir(exist_ok=True)
     print(f"\n输出目录: {PREVIEW_DIR}\n")
     
+    # 解析字体（只解析一次，所有角色共用）
+    resolve_all_fonts()
+    
     # 加载角色数据
     all_data = load_character_data()
     
@@ -270,6 +225,13 @@ def main():
     character_ids = sorted([key for key in all_data.keys() if key.startswith('chr_')])
     print(f"找到 {len(character_ids)} 个角色\n")
     
+    # 根据构建清单，只生成输入有变化的角色
+    manifest = load_manifest(BUILD_MANIFEST_PATH)
+    targets = {char_id: build_target(char_id, all_data[char_id]) for char_id in character_ids}
+    character_ids = plan_builds(manifest, targets, force=args.force)
+    skipped_count = len(targets) - len(character_ids)
+    print()
+    
     # 处理每个角色
     success_count = 0
     
@@ -279,11 +241,13 @@ def main():
         character_data = all_data[char_id]
         
         if create_preview_frame(char_id, character_data):
+            manifest[char_id] = targets[char_id][1]
+            save_manifest(BUILD_MANIFEST_PATH, manifest)
             success_count += 1
     
     # 输出统计信息
     print("\n" + "=" * 60)
-    print(f"完成！成功生成 {success_count}/{len(character_ids)} 个预览图")
+    print(f"完成！成功生成 {success_count}/{len(character_ids)} 个预览图，跳过 {skipped_count} 个（已是最新）")
     print(f"预览图保存在: {PREVIEW_DIR}")
     print("=" * 60)
 
@@ -0,0 +1,50 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 当前进程已连接的共享底图：名称 -> (SharedMemory, 只读numpy视图)
+# 必须保留SharedMemory对象，否则共享内存会被关闭，视图随之失效
+_attached = {}
+
+
+def publish_layers(layers):
+    """
+    主进程把只读底图放入共享内存，所有子进程共用同一份数据
+
+    Args:
+        layers: 名称 -> numpy数组
+
+    Returns:
+        (SharedMemory列表, 描述)：SharedMemory用完后交给release_layers释放，
+        描述可以传给子进程，由attach_layers连接
+    """
+    blocks = []
+    specs = {}
+    for name, array in layers.items():
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_layers(specs):
+    """子进程初始化时按描述连接共享底图，得到只读的numpy视图（不复制数据）"""
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        view.flags.writeable = False
+        _attached[name] = (block, view)
+
+
+def get_layer(name):
+    """返回已连接的共享底图（只读视图），没有时返回None"""
+    entry = _attached.get(name)
+    return entry[1] if entry is not None else None
+
+
+def release_layers(blocks):
+    """主进程在所有子进程结束后关闭并删除共享内存"""
+    for block in blocks:
+        block.close()
+        block.unlink()
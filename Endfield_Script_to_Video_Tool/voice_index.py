@@ -0,0 +1,71 @@
+def build_voice_index(character_data):
+    """
+    为单个角色建立 语音ID -> (标题, 描述) 的索引，每个角色只建立一次
+
+    优先使用profileVoice中的条目，找不到时再使用voices；
+    同一列表中有重复ID时以第一条为准（与逐条查找的结果一致）
+    """
+    index = {}
+    for list_name in ('profileVoice', 'voices'):
+        for voice in character_data.get(list_name, []):
+            voice_id = voice.get('voId')
+            if voice_id is None or voice_id in index:
+                continue
+            title = voice.get('voiceTitle', {}).get('id', '')
+            desc = voice.get('voiceDesc', {}).get('id', '')
+            index[voice_id] = (title, desc)
+    return index
+
+
+def get_voice_text(voice_index, voice_id):
+    """根据语音ID获取对应的标题和描述，找不到时返回空文本"""
+    return voice_index.get(voice_id, ("", ""))
+
+
+def check_voice_coverage(voice_index, voice_ids):
+    """
+    对比语音文件与文本数据
+
+    Returns:
+        (没有文本的语音ID列表, 没有语音文件的文本ID列表)
+    """
+    voice_ids = list(voice_ids)
+    available = set(voice_ids)
+    missing_text = [voice_id for voice_id in voice_ids
+                    if not any(get_voice_text(voice_index, voice_id))]
+    missing_voice = [voice_id for voice_id, texts in voice_index.items()
+                     if any(texts) and voice_id not in available]
+    return missing_text, missing_voice
+
+
+def report_voice_coverage(voice_index, voice_ids):
+    """打印没有文本的语音文件和没有语音文件的文本"""
+    missing_text, missing_voice = check_voice_coverage(voice_index, voice_ids)
+    if missing_text:
+        print(f"  提示: {len(missing_text)} 个语音文件没有文本: {', '.join(missing_text)}")
+    if missing_voice:
+        print(f"  提示: {len(missing_voice)} 条文本没有语音文件: {', '.join(missing_voice)}")
+    return missing_text, missing_voice
+
+
+def diff_voice_tables(old_table, new_table):
+    """
+    按(角色ID, 语音ID)比较新旧CharacterTable中的语音文本
+
+    Returns:
+        角色ID -> 有变化的语音ID列表（新增、删除或标题/描述被修改），按新表中的角色顺序
+    """
+    char_ids = list(new_table) + [char_id for char_id in old_table if char_id not in new_table]
+    changes = {}
+    for char_id in char_ids:
+        old_data = old_table.get(char_id, {})
+        new_data = new_table.get(char_id, {})
+        if not isinstance(old_data, dict) or not isinstance(new_data, dict):
+            continue
+        old_index = build_voice_index(old_data)
+        new_index = build_voice_index(new_data)
+        changed = sorted(voice_id for voice_id in old_index.keys() | new_index.keys()
+                         if old_index.get(voice_id) != new_index.get(voice_id))
+        if changed:
+            changes[char_id] = changed
+    return changes